@@ -0,0 +1,74 @@
+"""200枚のバッチ保存にかかる時間の計測
+
+アップロードされたバッファをそのまま1枚ずつ書き込む方法と、保存待ちの
+一時ファイルに受け取ってから rename でまとめて保存する方法を比較する。
+
+使い方:
+    python benchmarks/bench_batch_save.py --count 200
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_save_app as app  # noqa: E402
+from corpus import FakeUpload  # noqa: E402
+from image_save_core.batch_staging import stage_images  # noqa: E402
+
+
+def make_jpeg(width, height):
+    """ノイズ入りの JPEG を作成（実際の写真に近いサイズにする）"""
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def deep_size(pending):
+    """保存待ち画像1枚がセッションで占めるおおよそのバイト数"""
+    return sys.getsizeof(pending) + sum(sys.getsizeof(field) for field in pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    args = parser.parse_args()
+
+    data = make_jpeg(args.width, args.height)
+    uploads = [FakeUpload(f"photo_{i:04d}.jpg", data) for i in range(args.count)]
+    print(f"{args.count} images x {len(data) / 1024:.0f} KB")
+
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, "direct")
+        start = time.perf_counter()
+        app.save_images_from_upload(uploads, target)
+        direct = time.perf_counter() - start
+        print(f"direct write        {direct * 1000:9.1f} ms")
+
+        target = os.path.join(directory, "staged")
+        pipeline = app.get_save_pipeline()
+        start = time.perf_counter()
+        job, pending = stage_images(uploads, target, pipeline)
+        job.wait()
+        staged = time.perf_counter() - start
+        start = time.perf_counter()
+        saved, errors = app.save_images_from_upload(
+            pending, target, digests=job.digests, perceptual_hashes=job.perceptual_hashes
+        )
+        commit = time.perf_counter() - start
+        assert len(saved) == args.count and not job.errors and not errors
+        print(f"staging (parallel)  {staged * 1000:9.1f} ms")
+        print(f"batch save (rename) {commit * 1000:9.1f} ms")
+        print(f"session bytes/image {deep_size(pending[0]):9d}")
+
+
+if __name__ == "__main__":
+    main()
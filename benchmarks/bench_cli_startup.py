@@ -0,0 +1,57 @@
+"""コマンドライン版 (main.py) の起動時間の計測
+
+Streamlit 版のモジュールを読み込む場合と比べ、CLI が Streamlit・Pillow を
+読み込まずに起動できていることを確認する。
+
+使い方:
+    python benchmarks/bench_cli_startup.py --repeat 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(label, command, repeat):
+    """コマンドを繰り返し実行し、中央値と最良値を表示"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    print(f"{label:<24} median {statistics.median(times) * 1000:8.1f} ms  best {min(times) * 1000:8.1f} ms")
+    return statistics.median(times)
+
+
+def loaded_modules(code):
+    """コードを実行した後に読み込まれている重いモジュールを調べる"""
+    probe = code + "; import sys; print(' '.join(m for m in ('streamlit', 'PIL', 'numpy') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, check=True, capture_output=True, text=True)
+    return result.stdout.strip() or "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        python = sys.executable
+        measure("python (空)", [python, "-c", "pass"], args.repeat)
+        measure("main.py --help", [python, "main.py", "--help"], args.repeat)
+        measure("main.py list", [python, "main.py", "--save-dir", directory, "list"], args.repeat)
+        measure("import image_save_app", [python, "-c", "import image_save_app"], args.repeat)
+
+    print()
+    print(f"main.py が読み込むモジュール:        {loaded_modules('import main; main.build_parser()')}")
+    print(f"image_save_core が読み込むモジュール: {loaded_modules('import image_save_core')}")
+    print(f"image_save_app が読み込むモジュール:  {loaded_modules('import image_save_app')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""保存フォルダの分け方の変更（migrate_layout）にかかる時間の計測（動作確認を兼ねる）
+
+アプリと同じくフォルダ監視を動かしたまま flat → hash → date → flat の順に移動し、
+移動のたびに内容のハッシュと知覚ハッシュが1枚も失われていないことを確かめる。
+
+使い方:
+    python benchmarks/bench_migrate.py --count 3000
+    python benchmarks/bench_migrate.py --count 3000 --no-watcher
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import generate_corpus  # noqa: E402
+from image_save_core import (  # noqa: E402
+    ImageIndex, backfill_content_hashes, backfill_perceptual_hashes, migrate_layout,
+)
+from image_save_core.directory_watcher import DirectoryWatcher  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=3000, help="画像の枚数")
+    parser.add_argument("--layouts", default="hash,date,flat", help="移動する分け方の順（カンマ区切り）")
+    parser.add_argument("--no-watcher", action="store_true", help="フォルダ監視を動かさずに測る")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_corpus(directory, args.count)
+        index = ImageIndex(directory)
+        index.reconcile()
+        backfill_content_hashes(index)
+        backfill_perceptual_hashes(index)
+        assert not index.count_missing_content_hashes() and not index.count_missing_perceptual_hashes()
+
+        watcher = None if args.no_watcher else DirectoryWatcher(index)
+        if watcher is not None:
+            watcher.wait_ready()
+        try:
+            for layout in args.layouts.split(","):
+                start = time.perf_counter()
+                moved, errors = migrate_layout(index, layout)
+                seconds = time.perf_counter() - start
+                assert not errors, errors[:3]
+                # 移動の反映をフォルダ監視が追いかけ終わってから数える
+                time.sleep(1.0)
+                index.reconcile(force=True)
+                total = index.count_records()
+                missing_content = index.count_missing_content_hashes()
+                missing_phash = index.count_missing_perceptual_hashes()
+                print(
+                    f"{layout:<5} {moved:6d} moved  {seconds * 1000:9.1f} ms  "
+                    f"records {total}  no content_hash {missing_content}  no phash {missing_phash}"
+                )
+                assert total == args.count, total
+                assert not missing_content and not missing_phash, "移動でハッシュが失われました"
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""ヘッダーのみの解像度取得 (image_probe) と Image.open の速度比較
+
+使い方:
+    python benchmarks/bench_probe.py --count 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_save_core.image_probe import probe_image  # noqa: E402
+
+FORMATS = [
+    ("JPEG", "jpg", {"quality": 90}),
+    ("JPEG", "jpeg", {"quality": 85, "progressive": True}),
+    ("PNG", "png", {}),
+    ("GIF", "gif", {}),
+    ("BMP", "bmp", {}),
+]
+
+
+def generate_corpus(directory, count, size):
+    """各形式の画像を count 枚ずつ生成"""
+    paths = []
+    for image_format, ext, options in FORMATS:
+        for i in range(count):
+            image = Image.new("RGB", (size[0] + i % 7, size[1]), (i * 37 % 256, 80, 160))
+            if image_format == "JPEG" and i % 2 == 0:
+                # EXIF の向き (6 = 90度回転) 付きのファイルも混ぜる
+                exif = Image.Exif()
+                exif[0x0112] = 6
+                options = dict(options, exif=exif.tobytes())
+            path = os.path.join(directory, f"bench_{i:05d}.{ext}")
+            image.save(path, image_format, **options)
+            paths.append(path)
+    return paths
+
+
+def pillow_size(path):
+    """現在の Image.open による取得方法"""
+    with Image.open(path) as image:
+        return image.size
+
+
+def run(label, func, paths, repeat):
+    """最良時間を計測して表示"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        best = min(best, time.perf_counter() - start)
+    per_file = best / len(paths) * 1e6
+    print(f"{label:<14} {best * 1000:9.2f} ms  {per_file:8.2f} us/file")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="形式ごとの生成枚数")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = generate_corpus(directory, args.count, (args.width, args.height))
+
+        # 結果が Pillow と一致することを確認
+        for path in paths:
+            info = probe_image(path)
+            assert (info.width, info.height) == pillow_size(path), path
+
+        print(f"{len(paths)} files ({args.width}x{args.height})")
+        baseline = run("Image.open", pillow_size, paths, args.repeat)
+        probed = run("probe_image", probe_image, paths, args.repeat)
+        print(f"speedup        {baseline / probed:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
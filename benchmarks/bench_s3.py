@@ -0,0 +1,110 @@
+"""S3Backend の保存・一覧・取得・削除の計測（動作確認を兼ねる）
+
+--endpoint-url を指定しなければ moto のサーバーをこのプロセス内で起動して使う
+（pip install ".[s3]" "moto[server]"）。MinIO などで測る場合は接続先と認証情報を
+環境変数 AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY で指定し、バケットは空のものを使う。
+S3 の一覧はキーの順になる（保存元ごとに古い順）ことも確かめる。
+
+使い方:
+    python benchmarks/bench_s3.py --count 200
+    python benchmarks/bench_s3.py --endpoint-url http://localhost:9000 --bucket bench
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import FakeUpload  # noqa: E402
+from image_save_core.backends import S3Backend  # noqa: E402
+
+
+def start_moto_server():
+    """moto の S3 サーバーを空いているポートで起動し、(サーバー, 接続先) を返す"""
+    from moto.server import ThreadedMotoServer
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # moto は認証情報を検証しないが、boto3 は無いと署名できない
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    # リクエストごとのアクセスログで結果が読めなくなるため抑える
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def timed(label, func, items=None):
+    """func を1回実行して時間を表示し、戻り値を返す"""
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    line = f"{label:<24} {seconds * 1000:9.1f} ms"
+    if items:
+        line += f"  {items / seconds:9.0f} /s"
+    print(line)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="保存する画像の枚数")
+    parser.add_argument("--size-kb", type=int, default=300, help="画像1枚の大きさ（KB）")
+    parser.add_argument("--page-size", type=int, default=50, help="一覧の1ページの件数")
+    parser.add_argument("--endpoint-url", default=None, help="S3 互換ストレージの接続先（省略時は moto）")
+    parser.add_argument("--bucket", default="image-save-bench")
+    parser.add_argument("--region", default="us-east-1")
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        server, endpoint_url = start_moto_server()
+    import boto3
+
+    client = boto3.client("s3", endpoint_url=endpoint_url, region_name=args.region)
+    if server is not None:
+        client.create_bucket(Bucket=args.bucket)
+    # マルチパートの経路も通るよう、閾値を画像1枚より小さくする
+    threshold = 5 * 1024 * 1024
+    backend = S3Backend(
+        args.bucket, prefix="bench", endpoint_url=endpoint_url, region_name=args.region,
+        multipart_threshold=threshold, multipart_chunksize=threshold,
+    )
+    try:
+        data = os.urandom(args.size_kb * 1024)
+        uploads = [FakeUpload(f"photo_{i:04d}.jpg", data) for i in range(args.count)]
+        print(f"{args.count} images x {args.size_kb} KB -> {endpoint_url}/{args.bucket}")
+
+        keys, errors = timed("save_images", lambda: backend.save_images(uploads), args.count)
+        assert len(keys) == args.count and not errors, errors
+        large = os.urandom(threshold * 2 + 1)
+        timed("put (multipart)", lambda: backend.put("large_image.jpg", large))
+        keys.append("large_image.jpg")
+
+        listed = timed("list_page (all pages)", lambda: list(backend.iter_objects(args.page_size)), len(keys))
+        listed_keys = [item.key for item in listed]
+        assert sorted(listed_keys) == sorted(keys), "一覧のキーが保存したキーと一致しません"
+        # 一覧はキーの順（更新時刻の新しい順ではない）
+        assert listed_keys == sorted(listed_keys)
+
+        contents = timed("get_many", lambda: backend.get_many(keys[:args.count]), args.count)
+        assert all(content == data for content in contents)
+        assert backend.get("large_image.jpg") == large
+
+        result = timed("delete_images", lambda: backend.delete_images(keys), len(keys))
+        assert not result.errors, result.errors[:3]
+        assert not backend.list_page().objects
+    finally:
+        backend.close()
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""保存・一覧・メタデータ取得・類似画像検索・ギャラリー描画のベンチマーク一式
+
+100 / 10,000 / 100,000 枚の合成画像フォルダを作成して各処理の時間を計測し、
+結果を JSON に保存する。--compare で以前の結果と比較できる。
+
+使い方:
+    python benchmarks/bench_suite.py --sizes 100,10000
+    python benchmarks/bench_suite.py --sizes 100000 --no-render
+    python benchmarks/bench_suite.py --compare benchmarks/results/20240101_120000.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import FakeUpload, generate_corpus  # noqa: E402
+from image_save_core import (  # noqa: E402
+    ImageIndex, SimilarImageIndex, backfill_perceptual_hashes, import_files, list_saved_images, save_images,
+)
+from image_save_core.image_index import INDEX_FILE_NAME, is_image_filename, read_image_header  # noqa: E402
+from image_save_core.image_probe import probe_image  # noqa: E402
+from image_save_core.thumbnail_cache import THUMBNAIL_DIR_NAME  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def timed(func, repeat=1):
+    """最良時間（秒）と最後の戻り値を返す"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def reset_sidecars(directory):
+    """インデックスとサムネイルを消して、初回と同じ状態に戻す"""
+    for name in os.listdir(directory):
+        if name.startswith(INDEX_FILE_NAME):
+            os.remove(os.path.join(directory, name))
+    shutil.rmtree(os.path.join(directory, THUMBNAIL_DIR_NAME), ignore_errors=True)
+
+
+class Suite:
+    """計測結果を集めて表示するクラス"""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, name, corpus_size, seconds, items=None):
+        """結果を1件記録して表示"""
+        result = {"name": name, "corpus_size": corpus_size, "seconds": seconds}
+        line = f"{name:<28} {corpus_size:>7}  {seconds * 1000:10.2f} ms"
+        if items:
+            result["items"] = items
+            result["items_per_second"] = items / seconds if seconds else None
+            line += f"  {items / seconds:12.0f} /s" if seconds else ""
+        self.results.append(result)
+        print(line)
+
+    def bench_metadata(self, paths, corpus_size, sample=2000):
+        """ヘッダーからの解像度取得（1枚あたりのコスト）"""
+        sample_paths = paths[:sample]
+        seconds, _ = timed(lambda: [probe_image(path) for path in sample_paths], self.repeat)
+        self.record("metadata.probe_image", corpus_size, seconds, len(sample_paths))
+        seconds, _ = timed(lambda: [read_image_header(path) for path in sample_paths], self.repeat)
+        self.record("metadata.read_image_header", corpus_size, seconds, len(sample_paths))
+
+    def bench_listing(self, directory, corpus_size):
+        """インデックスの作成と一覧の取得"""
+        reset_sidecars(directory)
+        index = ImageIndex(directory)
+        seconds, _ = timed(index.reconcile)
+        self.record("listing.index_build", corpus_size, seconds, corpus_size)
+
+        def scandir_listing():
+            # インデックスを使わない場合の下限（フォルダの走査と並べ替えだけ）
+            with os.scandir(directory) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries if is_image_filename(entry.name)]
+            return sorted(files, reverse=True)
+
+        seconds, _ = timed(scandir_listing, self.repeat)
+        self.record("listing.scandir_sort", corpus_size, seconds, corpus_size)
+        seconds, _ = timed(lambda: list_saved_images(index, limit=20), self.repeat)
+        self.record("listing.first_page", corpus_size, seconds)
+        seconds, _ = timed(lambda: list_saved_images(index, limit=20, offset=corpus_size // 2), self.repeat)
+        self.record("listing.middle_page", corpus_size, seconds)
+        cutoff = time.time() - 30 * 24 * 60 * 60
+        seconds, _ = timed(lambda: list_saved_images(index, start_time=cutoff), self.repeat)
+        self.record("listing.last_30_days", corpus_size, seconds)
+        seconds, records = timed(lambda: list_saved_images(index), self.repeat)
+        self.record("listing.all_records", corpus_size, seconds, len(records))
+        index.close()
+
+    def bench_similarity(self, directory, corpus_size, queries=50):
+        """知覚ハッシュの一括計算と、似ている画像の検索"""
+        index = ImageIndex(directory)
+        index.reconcile()
+        seconds, (hashed, _) = timed(lambda: backfill_perceptual_hashes(index))
+        self.record("similarity.backfill", corpus_size, seconds, hashed)
+        similar = SimilarImageIndex(index)
+        seconds, _ = timed(similar.refresh)
+        self.record("similarity.index_build", corpus_size, seconds, len(similar))
+        paths = [record.path for record in index.list_records(limit=queries)]
+        seconds, _ = timed(lambda: [similar.find_similar(path, limit=50) for path in paths], self.repeat)
+        self.record("similarity.query", corpus_size, seconds, len(paths))
+        index.close()
+
+    def bench_save(self, paths, corpus_size, workdir, upload_count=500):
+        """アップロードの保存と、フォルダからの一括取り込み"""
+        uploads = []
+        for path in paths[:upload_count]:
+            with open(path, "rb") as f:
+                uploads.append(FakeUpload(os.path.basename(path), f.read()))
+
+        target = os.path.join(workdir, "uploads")
+        index = ImageIndex(target)
+        seconds, (saved, _) = timed(lambda: save_images(uploads, index))
+        self.record("save.upload_batch", corpus_size, seconds, len(saved))
+        index.close()
+
+        target = os.path.join(workdir, "ingest")
+        index = ImageIndex(target)
+        seconds, (saved, _, errors) = timed(lambda: import_files(paths, index, dedup="off"))
+        assert not errors, errors[:3]
+        self.record("save.ingest_folder", corpus_size, seconds, saved)
+        index.close()
+
+    def bench_render(self, directory, corpus_size):
+        """ギャラリー画面を AppTest で描画（サムネイル作成を含む初回と2ページ目）"""
+        from streamlit.testing.v1 import AppTest
+
+        # 描画のたびに出る非推奨の警告で結果が読めなくなるため抑える
+        logging.getLogger("streamlit").setLevel(logging.ERROR)
+        reset_sidecars(directory)
+        app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "image_save_app.py")
+        at = AppTest.from_file(app_path, default_timeout=600)
+        at.run()
+        at.sidebar.text_input[0].set_value(directory).run()
+
+        seconds, _ = timed(lambda: at.sidebar.radio[0].set_value("保存済み画像を表示").run())
+        assert not at.exception, at.exception
+        self.record("render.gallery_first", corpus_size, seconds)
+
+        page = [field for field in at.number_input if field.label == "ページ"]
+        if page:
+            seconds, _ = timed(lambda: page[0].set_value(2).run())
+            assert not at.exception, at.exception
+            self.record("render.gallery_page_2", corpus_size, seconds)
+
+        seconds, _ = timed(lambda: at.run(), self.repeat)
+        self.record("render.gallery_rerun", corpus_size, seconds)
+
+
+def compare(previous_path, results):
+    """以前の結果と比べて、時間の比（今回 / 以前）を表示"""
+    with open(previous_path) as f:
+        previous = {
+            (result["name"], result["corpus_size"]): result["seconds"] for result in json.load(f)["results"]
+        }
+    print()
+    print(f"比較: {previous_path}")
+    for result in results:
+        before = previous.get((result["name"], result["corpus_size"]))
+        if before:
+            ratio = result["seconds"] / before
+            mark = "  遅くなった" if ratio > 1.1 else ("  速くなった" if ratio < 0.9 else "")
+            print(f"{result['name']:<28} {result['corpus_size']:>7}  {ratio:6.2f}x{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,10000", help="画像の枚数（カンマ区切り、例: 100,10000,100000）")
+    parser.add_argument("--repeat", type=int, default=3, help="繰り返して最良値を取る回数")
+    parser.add_argument("--corpus-root", default=None, help="合成画像フォルダの置き場所（指定すると次回も再利用）")
+    parser.add_argument("--no-render", action="store_true", help="AppTest による描画の計測を省く")
+    parser.add_argument("--output", default=None, help="結果の JSON（既定: benchmarks/results/<日時>.json）")
+    parser.add_argument("--compare", default=None, help="比較する以前の結果の JSON")
+    args = parser.parse_args()
+
+    suite = Suite(args.repeat)
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_root = args.corpus_root or os.path.join(workdir, "corpus")
+        for corpus_size in [int(size) for size in args.sizes.split(",")]:
+            directory = os.path.join(corpus_root, str(corpus_size))
+            start = time.perf_counter()
+            paths = generate_corpus(directory, corpus_size)
+            print(f"--- {corpus_size} 枚（準備 {time.perf_counter() - start:.1f} 秒）")
+
+            suite.bench_metadata(paths, corpus_size)
+            suite.bench_listing(directory, corpus_size)
+            suite.bench_similarity(directory, corpus_size)
+            save_dir = os.path.join(workdir, f"save_{corpus_size}")
+            suite.bench_save(paths, corpus_size, save_dir)
+            shutil.rmtree(save_dir)
+            if not args.no_render:
+                suite.bench_render(directory, corpus_size)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": suite.results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {output}")
+
+    if args.compare:
+        compare(args.compare, suite.results)
+
+
+if __name__ == "__main__":
+    main()
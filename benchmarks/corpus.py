@@ -0,0 +1,77 @@
+"""ベンチマーク用の合成画像フォルダの作成
+
+画像は数種類のテンプレートから作り、末尾に連番のバイト列を付けて内容を
+ファイルごとに変える（JPEG/PNG とも終端以降のデータは無視される）。
+更新時刻は過去1年に散らばらせ、期間の絞り込みやページ送りも実際に近づける。
+アップロードされた画像の代わりには FakeUpload を使う。
+"""
+import io
+import os
+import random
+import shutil
+import struct
+import time
+
+from PIL import Image
+
+# 作成済みのフォルダに置く目印（枚数を書いておき、同じ枚数なら作り直さない）
+MARKER_FILE_NAME = ".corpus"
+
+_TEMPLATE_SIZES = [(640, 480), (480, 640), (1024, 768), (320, 240), (800, 600), (600, 800)]
+
+
+class FakeUpload(io.BytesIO):
+    """st.file_uploader が返す UploadedFile の代わり"""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.type = "image/jpeg"
+        self.size = len(data)
+
+
+def _templates(seed):
+    """JPEG と PNG のテンプレート画像を作成"""
+    rng = random.Random(seed)
+    templates = []
+    for n, size in enumerate(_TEMPLATE_SIZES):
+        image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        # 単色だと小さすぎるため、ノイズを少し入れる
+        image.paste(Image.frombytes("RGB", (64, 64), rng.randbytes(64 * 64 * 3)), (0, 0))
+        for image_format, ext in (("JPEG", ".jpg"), ("PNG", ".png")):
+            buffer = io.BytesIO()
+            image.save(buffer, image_format)
+            templates.append((buffer.getvalue(), ext))
+    return templates
+
+
+def generate_corpus(directory, count, seed=0, days=365):
+    """directory に count 枚の画像を作成し、パスのリストを返す（作成済みなら再利用）"""
+    marker = os.path.join(directory, MARKER_FILE_NAME)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read().strip() == str(count):
+                return sorted(
+                    os.path.join(directory, name) for name in os.listdir(directory) if not name.startswith(".")
+                )
+        # 枚数の違う作成済みフォルダは作り直す
+        shutil.rmtree(directory)
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    templates = _templates(seed)
+    now = time.time()
+    paths = []
+    for i in range(count):
+        data, ext = templates[i % len(templates)]
+        path = os.path.join(directory, f"img_{i:06d}{ext}")
+        with open(path, "wb") as f:
+            f.write(data)
+            f.write(struct.pack(">Q", i))
+        mtime = now - rng.random() * days * 24 * 60 * 60
+        os.utime(path, (mtime, mtime))
+        paths.append(path)
+
+    with open(marker, "w") as f:
+        f.write(str(count))
+    return paths
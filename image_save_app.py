@@ -1,74 +1,419 @@
 import streamlit as st
 import os
-from datetime import datetime
-from PIL import Image
-import io
-import glob
-
-def get_saved_images(save_directory="saved_images"):
-    """保存されている画像ファイルの一覧を取得"""
-    if not os.path.exists(save_directory):
-        return []
+from datetime import datetime, timedelta
+from functools import partial
+from image_save_core import metrics, storage
+from image_save_core.backends import LocalBackend, S3Backend
+from image_save_core.batch_staging import discard_pending, purge_staging, stage_images
+from image_save_core.directory_watcher import DirectoryWatcher
+from image_save_core.file_cache import FileCache
+from image_save_core.image_index import ImageIndex
+from image_save_core.image_probe import probe_image
+from image_save_core.ingest import INGEST_PROFILES, IngestProcessor
+from image_save_core.layout import LAYOUTS, find_save_directory, read_layout, write_layout
+from image_save_core.perceptual_hash import DEFAULT_MAX_DISTANCE, SimilarImageIndex
+from image_save_core.save_pipeline import FSYNC_POLICIES, SavePipeline
+from image_save_core.storage import DEDUP_POLICIES
+from image_save_core.tasks import BackgroundTask
+from image_save_core.thumbnail_cache import ThumbnailCache
+from image_save_core.trash import TrashPurger
+from image_save_core.zip_export import MISSING_FILES_NAME, build_zip_archive
+
+# ブラウザからの ZIP は Streamlit がダウンロードされるまでメモリ上に保持するため、この大きさまでにする
+# （それより大きい場合は python main.py export でファイルに書き出す）
+MAX_BROWSER_ZIP_BYTES = 512 * 1024 * 1024
+
+@st.cache_resource
+def get_image_index(save_directory="saved_images"):
+    """保存フォルダごとのメタデータインデックスを取得（セッション間で共有）"""
+    return ImageIndex(save_directory)
+
+def get_saved_image_records(save_directory="saved_images", start_time=None, end_time=None, limit=None, offset=0):
+    """保存されている画像のメタデータ一覧を取得（新しい順、期間・件数で絞り込み可能）
+
+    インデックスはフォルダ監視が更新するため、再実行のたびにフォルダを走査し直さない。
+    """
+    get_directory_watcher(save_directory).wait_ready()
+    return storage.list_saved_images(
+        get_image_index(save_directory), start_time, end_time, limit, offset, rescan=False
+    )
+
+def count_saved_images(save_directory="saved_images", start_time=None, end_time=None):
+    """保存されている画像の枚数を取得（期間で絞り込み可能、走査はフォルダ監視に任せる）"""
+    get_directory_watcher(save_directory).wait_ready()
+    return storage.count_saved_images(get_image_index(save_directory), start_time, end_time, rescan=False)
+
+@st.cache_resource
+def get_storage_backend(save_directory="saved_images", kind="local"):
+    """保存先のバックエンドを取得（S3 は環境変数 IMAGE_SAVE_S3_BUCKET などで設定）"""
+    if kind == "s3":
+        return S3Backend(
+            os.environ["IMAGE_SAVE_S3_BUCKET"],
+            prefix=os.environ.get("IMAGE_SAVE_S3_PREFIX", ""),
+            endpoint_url=os.environ.get("IMAGE_SAVE_S3_ENDPOINT_URL"),
+        )
+    return LocalBackend(get_image_index(save_directory), get_file_cache())
+
+def get_saved_images(save_directory="saved_images", kind="local"):
+    """保存されている画像の一覧を取得（バックエンドからページ単位で読む）"""
+    return [item.key for item in get_storage_backend(save_directory, kind).iter_objects()]
+
+@st.cache_resource
+def get_directory_watcher(save_directory="saved_images"):
+    """保存フォルダの監視スレッドを取得（同じフォルダを見る全セッションで1つ）"""
+    return DirectoryWatcher(get_image_index(save_directory))
+
+@st.fragment(run_every=2)
+def watch_gallery(watcher):
+    """フォルダの変更を確認し、変更があった時だけ画面を更新"""
+    if st.session_state.get("gallery_version") != watcher.version:
+        # 枚数・ページ数も変わるため画面全体を更新する（変更の無いタイルのサムネイルはキャッシュから返る）
+        st.rerun()
+
+@st.cache_resource
+def get_thumbnail_cache(save_directory="saved_images"):
+    """保存フォルダごとのサムネイルキャッシュを取得（セッション間で共有）"""
+    return ThumbnailCache(save_directory)
+
+@st.cache_resource
+def get_file_cache():
+    """画像ファイルの中身のキャッシュを取得（プロセス全体・全セッションで共有）"""
+    return FileCache()
+
+def read_image_bytes(filepath):
+    """表示・ダウンロード用に画像ファイルを読み込む（共有キャッシュ経由）"""
+    return get_file_cache().get(filepath)
+
+def build_gallery_zip(index, start_time=None, end_time=None):
+    """インデックスに登録された画像（期間指定可）をZIPにまとめる"""
+    return build_zip_archive([record.path for record in index.list_records(start_time, end_time)])
+
+@st.cache_resource
+def get_trash_purger(save_directory="saved_images"):
+    """保存フォルダごとに古いゴミ箱を定期削除するスレッドを開始（プロセスで1つ）"""
+    return TrashPurger(save_directory)
+
+def delete_image_files(filepaths, save_directory="saved_images", kind="local"):
+    """画像をまとめて削除（ローカルはゴミ箱に移動）し、ファイルごとの結果（TrashResult）を返す"""
+    return get_storage_backend(save_directory, kind).delete_images(filepaths)
+
+def delete_image_file(filepath, save_directory=None, kind="local"):
+    """画像ファイルを削除（ローカルはゴミ箱に移動）"""
+    result = delete_image_files([filepath], save_directory or find_save_directory(filepath), kind)
+    return not result.errors
+
+def restore_deleted_images(moved, save_directory="saved_images"):
+    """ゴミ箱に移動した画像を元に戻す"""
+    return storage.restore_images(moved, get_image_index(save_directory))
+
+def toggle_selection(filepath, key):
+    """選択チェックボックスの変更を選択中の画像一覧に反映"""
+    if st.session_state[key]:
+        st.session_state.selected_images.add(filepath)
+    else:
+        st.session_state.selected_images.discard(filepath)
+
+def set_selection(filepaths):
+    """選択中の画像を置き換え、チェックボックスの状態も作り直す"""
+    st.session_state.selected_images = set(filepaths)
+    for key in [key for key in st.session_state if str(key).startswith("select_")]:
+        del st.session_state[key]
+
+def select_filtered(save_directory, start_time=None, end_time=None):
+    """絞り込み結果の画像を全て選択"""
+    index = get_image_index(save_directory)
+    set_selection(record.path for record in index.list_records(start_time, end_time))
+
+@st.cache_resource
+def get_background_tasks():
+    """ハッシュの一括計算などのバックグラウンド処理（全セッションで共有し、同じ処理を重ねて始めない）"""
+    return {}
+
+def start_background_task(key, label, target):
+    """バックグラウンド処理を開始（同じ処理が実行中なら何もしない）"""
+    tasks = get_background_tasks()
+    task = tasks.get(key)
+    if task is None or task.done:
+        tasks[key] = BackgroundTask(target, label)
+
+@st.fragment(run_every=1)
+def show_backfill_progress(key):
+    """ハッシュの一括計算の進捗を表示（1秒ごとに更新）"""
+    task = get_background_tasks().get(key)
+    if task is None:
+        return
+    if not task.done:
+        st.progress(task.progress, text=f"🧮 {task.label}: {task.completed}/{task.total} 枚")
+        return
+    if task.error is not None:
+        st.error(f"❌ {task.label}に失敗しました: {task.error}")
+    else:
+        hashed, failed = task.result
+        st.success(f"✅ {task.label}: {hashed} 枚を計算しました" + (f"（読めない画像 {failed} 枚）" if failed else ""))
+    # 終わった時に一度だけ画面全体を更新し、未計算の枚数の表示を消す
+    finished = st.session_state.setdefault("finished_tasks", set())
+    if task not in finished:
+        finished.add(task)
+        st.rerun()
+
+@st.cache_resource
+def get_similar_image_index(save_directory="saved_images"):
+    """保存フォルダごとの類似画像の索引を取得（セッション間で共有）"""
+    return SimilarImageIndex(get_image_index(save_directory))
+
+def show_similar(filepath):
+    """似ている画像の表示を開始"""
+    st.session_state.similar_to = filepath
+
+def show_similar_images(save_directory, thumbnail_cache):
+    """選んだ画像に似ている画像を近い順に表示"""
+    target = st.session_state.similar_to
+    col_title, col_close = st.columns([4, 1])
+    with col_title:
+        st.subheader(f"🔎 {os.path.basename(target)} に似ている画像")
+    with col_close:
+        if st.button("✖️ 閉じる", key="close_similar", use_container_width=True):
+            st.session_state.similar_to = None
+            st.rerun()
     
-    # 対応する画像形式
-    extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.bmp']
-    image_files = []
+    backfill_key = ("perceptual_hash", save_directory)
+    missing_count = get_image_index(save_directory).count_missing_perceptual_hashes()
+    if missing_count:
+        st.info(f"ℹ️ {missing_count} 枚は似ている画像の検索用の情報（知覚ハッシュ）が未計算です")
+        # 全ての CPU コアを使う計算なので、画面を止めないようバックグラウンドで行う
+        st.button(
+            f"🧮 {missing_count} 枚をまとめて計算", key="backfill_hashes",
+            on_click=start_background_task,
+            args=(backfill_key, "知覚ハッシュの計算", partial(storage.backfill_perceptual_hashes, get_image_index(save_directory)))
+        )
+    show_backfill_progress(backfill_key)
     
-    for ext in extensions:
-        pattern = os.path.join(save_directory, ext)
-        image_files.extend(glob.glob(pattern))
-        # 大文字の拡張子も対応
-        pattern = os.path.join(save_directory, ext.upper())
-        image_files.extend(glob.glob(pattern))
+    max_distance = st.slider(
+        "似ている度合い（違うビット数の上限）", min_value=0, max_value=16, value=DEFAULT_MAX_DISTANCE,
+        key="similar_max_distance",
+        help="0 はほぼ同じ画像だけ、大きくすると構図や色の近い画像も含めます"
+    )
+    results = get_similar_image_index(save_directory).find_similar(target, max_distance, limit=50)
+    if not results:
+        st.write("似ている画像は見つかりませんでした")
+        return
     
-    # ファイル名でソート（新しい順）
-    image_files.sort(key=os.path.getmtime, reverse=True)
-    return image_files
-
-def delete_image_file(filepath):
-    """画像ファイルを削除"""
-    try:
-        os.remove(filepath)
-        return True
-    except Exception as e:
-        return False
-
-def save_image_from_camera(image_data, save_directory="saved_images", image_number=1):
+    cols_per_row = 4
+    for i in range(0, len(results), cols_per_row):
+        cols = st.columns(cols_per_row)
+        for j, (distance, filepath) in enumerate(results[i:i + cols_per_row]):
+            with cols[j]:
+                try:
+                    st.image(thumbnail_cache.get(filepath), caption=os.path.basename(filepath), use_column_width=True)
+                except OSError:
+                    st.error(f"❌ 画像の読み込みエラー: {os.path.basename(filepath)}")
+                    continue
+                st.caption(f"違い {distance} ビット")
+                st.button(
+                    "🔎 この画像で探す", key=f"similar_from_{i + j}", on_click=show_similar, args=(filepath,),
+                    use_container_width=True
+                )
+    st.write("---")
+
+@st.cache_resource
+def get_ingest_processor():
+    """保存前の縮小・形式変換用プロセスプールを取得（セッション間で共有）"""
+    return IngestProcessor()
+
+@st.cache_resource
+def get_save_pipeline():
+    """画像保存用のバックグラウンドパイプラインを取得（セッション間で共有）"""
+    return SavePipeline()
+
+def save_image_from_camera(image_data, save_directory="saved_images", image_number=1, fsync="none", dedup="off",
+                           kind="local"):
     """カメラで撮影した画像を保存する関数"""
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"camera_image_{timestamp}_{image_number:02d}.jpg"
-    filepath = os.path.join(save_directory, filename)
-    
-    # 画像を保存
-    with open(filepath, "wb") as f:
-        f.write(image_data.getbuffer())
-    
-    return filepath
+    saved_files, errors = save_images_from_upload(
+        [image_data], save_directory, fsync, dedup, start_number=image_number, source="camera", kind=kind
+    )
+    if errors:
+        raise OSError(errors[0][1])
+    return saved_files[0]
+
+def save_images_from_upload(uploaded_files, save_directory="saved_images", fsync="none", dedup="off",
+                            digests=None, start_number=1, source="upload", kind="local", staging_errors=None,
+                            perceptual_hashes=None):
+    """アップロードした画像を保存し、(保存先のリスト, 失敗のリスト) を返す（詳細は storage.save_images を参照）"""
+    return get_storage_backend(save_directory, kind).save_images(
+        uploaded_files, start_number, source, staging_errors, fsync=fsync, dedup=dedup, digests=digests,
+        perceptual_hashes=perceptual_hashes,
+    )
+
+def collect_staging_results():
+    """受け取り中の画像の書き込みを待ち、一時ファイルの SHA-256・知覚ハッシュと失敗の対応を返す"""
+    digests = {}
+    perceptual_hashes = {}
+    staging_errors = {}
+    for job in st.session_state.save_jobs:
+        job.wait()
+        digests.update(job.digests)
+        perceptual_hashes.update(job.perceptual_hashes)
+        staging_errors.update(job.errors)
+    return digests, perceptual_hashes, staging_errors
 
-def save_images_from_upload(uploaded_files, save_directory="saved_images"):
-    """アップロードした画像を保存する関数"""
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
+def show_save_errors(errors):
+    """保存できなかった画像をファイルごとに表示"""
+    st.error(f"❌ {len(errors)} 枚の画像を保存できませんでした")
+    for name, error in errors:
+        st.caption(f"`{name}`: {error}")
+
+@st.fragment(run_every=1)
+def show_save_progress():
+    """バックグラウンド保存の進捗を表示（1秒ごとに更新）"""
+    for job in st.session_state.save_jobs:
+        if not job.done:
+            st.progress(job.progress, text=f"💾 {job.label}: {job.completed}/{job.total} 枚を保存中")
+        elif job.errors:
+            st.error(f"❌ {job.label}: {len(job.errors)} 枚の保存に失敗しました")
+            for filepath, error in job.errors:
+                st.caption(f"`{os.path.basename(filepath)}`: {error}")
+        else:
+            st.success(f"✅ {job.label}: {len(job.saved_files)} 枚の保存が完了しました")
     
-    saved_files = []
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if all(job.done for job in st.session_state.save_jobs):
+        if st.button("表示をクリア", key="clear_save_jobs"):
+            st.session_state.save_jobs = []
+            st.rerun()
+
+def show_pending_preview(pending_images, thumbnail_cache, caption_prefix, limit=12):
+    """保存待ち画像をサムネイルでプレビュー（多い場合は先頭のみ）"""
+    cols_per_row = 4
+    shown = pending_images[:limit]
+    for i in range(0, len(shown), cols_per_row):
+        cols = st.columns(cols_per_row)
+        for j, pending in enumerate(shown[i:i + cols_per_row]):
+            with cols[j]:
+                if os.path.exists(pending.staged_path):
+                    st.image(thumbnail_cache.get(pending.staged_path), caption=f"{caption_prefix} {i + j + 1}", use_column_width=True)
+                else:
+                    st.info(f"⏳ {caption_prefix} {i + j + 1} を受け取り中")
+    if len(pending_images) > limit:
+        st.caption(f"ほか {len(pending_images) - limit} 枚")
+
+def show_saved_downloads(saved_files, key_prefix, backend):
+    """保存したファイルのダウンロードボタンを表示（押された時に読み込む）"""
+    st.write("**📥 ダウンロード:**")
+    for i, filepath in enumerate(saved_files, 1):
+        filename = os.path.basename(filepath)
+        st.download_button(
+            label=f"📱 画像{i}をダウンロード",
+            data=partial(backend.get, filepath),
+            file_name=filename,
+            mime=f"image/{filepath.split('.')[-1].lower()}",
+            key=f"{key_prefix}_{i}"
+        )
+
+def show_remote_gallery(backend):
+    """オブジェクトストレージの画像をページ単位で表示（続きは継続トークンで読む）"""
+    st.caption("※ S3 の一覧はファイル名の順です（保存元ごとに古い順。保存フォルダのような新しい順にはなりません）")
+    page_size = st.selectbox("1ページの表示枚数", [10, 20, 50, 100], index=1, key="remote_page_size")
+    # 表示したページの継続トークンを覚えておき、前のページに戻れるようにする
+    tokens = st.session_state.setdefault("remote_page_tokens", [None])
+    page = backend.list_page(page_size, tokens[-1])
+    if not page.objects and len(tokens) == 1:
+        st.info("📂 保存された画像がありません")
+        return
     
-    for i, uploaded_file in enumerate(uploaded_files, 1):
-        file_extension = uploaded_file.name.split('.')[-1]
-        filename = f"upload_image_{timestamp}_{i:02d}.{file_extension}"
-        filepath = os.path.join(save_directory, filename)
-        
-        with open(filepath, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        saved_files.append(filepath)
+    # 表示する画像はまとめて並列にダウンロード
+    images = backend.get_many([item.key for item in page.objects])
+    cols_per_row = 2
+    for i in range(0, len(page.objects), cols_per_row):
+        cols = st.columns(cols_per_row)
+        for j, (item, data) in enumerate(zip(page.objects[i:i + cols_per_row], images[i:i + cols_per_row])):
+            with cols[j]:
+                try:
+                    st.image(data, caption=item.key, use_column_width=True)
+                except Exception:
+                    st.error(f"❌ 画像の読み込みエラー: {item.key}")
+                st.caption(f"💾 {item.size / 1024:.1f}KB | 🕒 {datetime.fromtimestamp(item.mtime).strftime('%Y/%m/%d %H:%M')}")
+                col_download, col_delete = st.columns(2)
+                with col_download:
+                    st.download_button(
+                        label="📥",
+                        data=data,
+                        file_name=os.path.basename(item.key),
+                        mime=f"image/{item.key.split('.')[-1].lower()}",
+                        key=f"download_remote_{item.key}",
+                        help="ダウンロード"
+                    )
+                with col_delete:
+                    if st.button("🗑️", key=f"delete_remote_{item.key}", help="削除（元に戻せません）"):
+                        result = backend.delete_images([item.key])
+                        if result.errors:
+                            st.error(f"❌ {item.key} の削除に失敗しました")
+                        else:
+                            st.rerun()
     
-    return saved_files
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ 前へ", disabled=len(tokens) == 1, use_container_width=True):
+            tokens.pop()
+            st.rerun()
+    with col_info:
+        st.write(f"📄 {len(tokens)} ページ目")
+    with col_next:
+        if st.button("次へ ▶", disabled=page.next_token is None, use_container_width=True):
+            tokens.append(page.next_token)
+            st.rerun()
+
+@st.cache_resource
+def start_metrics_export():
+    """環境変数の設定に従って計測結果の書き出しを開始し、書き出し先ファイルを返す
+
+    IMAGE_SAVE_METRICS_FILE: Prometheus 形式で書き出すファイル（再実行のたびに更新）
+    IMAGE_SAVE_METRICS_PORT: /metrics を返す HTTP サーバーのポート
+    どちらかを設定すると、計測は最初から有効になる。
+    """
+    metrics_file = os.environ.get("IMAGE_SAVE_METRICS_FILE")
+    metrics_port = os.environ.get("IMAGE_SAVE_METRICS_PORT")
+    if metrics_port:
+        metrics.serve_prometheus(int(metrics_port))
+    if metrics_file or metrics_port:
+        metrics.set_enabled(True)
+    return metrics_file
+
+def toggle_metrics():
+    """計測の切り替えをプロセス全体に反映"""
+    metrics.set_enabled(st.session_state.measure_timing)
+
+def show_timing_panel(recorder):
+    """この再実行の処理時間の内訳をサイドバーに表示"""
+    metrics.stop_recording(recorder)
+    total = recorder.elapsed
+    with st.sidebar.expander(f"⏱️ 処理時間（この再実行 {total * 1000:.0f} ms）", expanded=True):
+        rows = sorted(recorder.timers.items(), key=lambda item: item[1].seconds, reverse=True)
+        if rows:
+            st.table([
+                {
+                    "処理": name,
+                    "回数": stats.calls,
+                    "合計 (ms)": round(stats.seconds * 1000, 1),
+                    "最大 (ms)": round(stats.max_seconds * 1000, 1),
+                    "割合": f"{stats.seconds / total * 100:.0f}%",
+                }
+                for name, stats in rows
+            ])
+            st.caption("※ 入れ子になった処理（一覧取得の中のインデックス更新など）は重複して数えます")
+        else:
+            st.caption("計測対象の処理は実行されませんでした（描画のみ）")
+        for name, value in sorted(recorder.counters.items()):
+            st.caption(f"{name}: {value}")
+        st.download_button(
+            "📤 Prometheus 形式で書き出し",
+            data=metrics.export_prometheus,
+            file_name="image_save_metrics.prom",
+            mime="text/plain",
+        )
 
 def main():
+    metrics_file = start_metrics_export()
+    recorder = metrics.start_recording() if st.session_state.get("measure_timing") else None
+    
     st.title("📱 カメラ撮影 & 画像保存アプリ")
     st.write("カメラで直接撮影、またはファイルをアップロードして保存できます")
     
@@ -77,6 +422,92 @@ def main():
         st.header("⚙️ 設定")
         save_dir = st.text_input("保存フォルダ名", value="saved_images")
         st.info("画像は選択したフォルダに保存されます")
+        storage_kind = "local"
+        if os.environ.get("IMAGE_SAVE_S3_BUCKET"):
+            storage_kind = st.selectbox(
+                "保存先",
+                ["local", "s3"],
+                format_func=lambda kind: {
+                    "local": "保存フォルダ（このサーバー）",
+                    "s3": f"S3 バケット（{os.environ['IMAGE_SAVE_S3_BUCKET']}）",
+                }[kind],
+                help="S3 を選ぶと、撮影・アップロードした画像は保存フォルダを一時置き場にしてバケットへ転送されます"
+            )
+        backend = get_storage_backend(save_dir, storage_kind)
+        ingest_profile_key = st.selectbox(
+            "保存時の画質プロファイル",
+            list(INGEST_PROFILES),
+            format_func=lambda key: INGEST_PROFILES[key].label,
+            help="縮小や JPEG/WebP への変換で保存容量と表示の通信量を減らせます（GIF はそのまま保存）"
+        )
+        ingest_profile = INGEST_PROFILES[ingest_profile_key]
+        fsync_policy = st.selectbox(
+            "ディスクへの書き込み確認",
+            FSYNC_POLICIES,
+            format_func=lambda policy: {
+                "none": "しない（高速）",
+                "file": "ファイルごとに確認",
+                "full": "ファイルとフォルダを確認（最も安全）",
+            }[policy],
+            help="ネットワークドライブなどで電源断に備える場合は確認を有効にしてください"
+        )
+        
+        dedup_policy = st.selectbox(
+            "同じ内容の画像の扱い",
+            DEDUP_POLICIES,
+            format_func=lambda policy: {
+                "skip": "保存しない（既存の画像を使う）",
+                "hardlink": "ハードリンクとして保存（容量を使わない）",
+                "off": "そのまま保存する",
+            }[policy],
+            help="保存時に内容のハッシュを計算し、保存済みの画像と同じなら容量を使わずに済ませます"
+        )
+        if storage_kind == "local" and dedup_policy != "off" and os.path.isdir(save_dir):
+            # 以前から保存フォルダにあった画像は、同じ大きさの画像を保存する時にその場で計算する
+            backfill_key = ("content_hash", save_dir)
+            unhashed_count = get_image_index(save_dir).count_missing_content_hashes()
+            if unhashed_count:
+                st.caption(f"ℹ️ {unhashed_count} 枚は重複の判定用の内容のハッシュが未計算です")
+                st.button(
+                    f"♻️ {unhashed_count} 枚をまとめて計算",
+                    on_click=start_background_task,
+                    args=(backfill_key, "内容のハッシュの計算", partial(storage.backfill_content_hashes, get_image_index(save_dir)))
+                )
+            show_backfill_progress(backfill_key)
+        current_layout = read_layout(save_dir)
+        layout = st.selectbox(
+            "保存先フォルダの分け方",
+            LAYOUTS,
+            index=LAYOUTS.index(current_layout),
+            format_func=lambda layout: {
+                "flat": "分けない（保存フォルダの直下）",
+                "date": "保存日ごと（年/月/日）",
+                "hash": "ファイル名のハッシュで分散",
+            }[layout],
+            help="数万枚を超える場合、フォルダを分けると1フォルダあたりのファイル数が減り、一覧の更新が速くなります"
+        )
+        if layout != current_layout:
+            write_layout(save_dir, layout)
+        if st.button("📂 保存済みの画像をこの分け方に移動", disabled=not os.path.isdir(save_dir)):
+            with st.spinner("画像を移動中..."):
+                moved_count, move_errors = storage.migrate_layout(get_image_index(save_dir), layout, get_file_cache())
+            st.success(f"✅ {moved_count} 枚を移動しました")
+            if move_errors:
+                st.error(f"❌ {len(move_errors)} 枚は移動できませんでした")
+        batch_limit = st.number_input(
+            "1回にまとめて保存する枚数",
+            min_value=1,
+            max_value=500,
+            value=2,
+            help="撮影・アップロードした画像をこの枚数までまとめて保存できます"
+        )
+        st.checkbox(
+            "⏱️ 処理時間を計測",
+            value=metrics.is_enabled(),
+            key="measure_timing",
+            on_change=toggle_metrics,
+            help="一覧の取得・保存・画像の読み込みなどにかかった時間を再実行ごとに表示します（計測は全セッション共通）"
+        )
         
         # モードの選択
         st.header("📷 モード選択")
@@ -91,15 +522,33 @@ def main():
         st.session_state.camera_images = []
     if 'saved_camera_files' not in st.session_state:
         st.session_state.saved_camera_files = []
+    if 'save_jobs' not in st.session_state:
+        st.session_state.save_jobs = []
+    if 'upload_batch' not in st.session_state:
+        st.session_state.upload_batch = []
+    if 'selected_images' not in st.session_state:
+        st.session_state.selected_images = set()
+    if 'pending_delete' not in st.session_state:
+        st.session_state.pending_delete = None
+    if 'last_delete' not in st.session_state:
+        st.session_state.last_delete = None
+    if 'similar_to' not in st.session_state:
+        st.session_state.similar_to = None
+    if 'uploader_key' not in st.session_state:
+        st.session_state.uploader_key = 0
+        # 放置された保存待ちの一時ファイルを片付ける（セッション開始時のみ）
+        purge_staging(save_dir)
+    
+    thumbnail_cache = get_thumbnail_cache(save_dir)
     
     if mode == "カメラで直接撮影":
         st.header("📸 カメラ撮影モード")
         
         # 現在の撮影枚数を表示
         current_count = len(st.session_state.camera_images)
-        st.write(f"**撮影済み: {current_count}/2枚**")
+        st.write(f"**撮影済み: {current_count}/{batch_limit}枚**")
         
-        if current_count < 2:
+        if current_count < batch_limit:
             st.write(f"📷 {current_count + 1}枚目を撮影してください")
             
             # カメラ入力
@@ -109,11 +558,17 @@ def main():
             )
             
             if camera_image is not None:
-                # 撮影した画像をセッション状態に保存
+                # 撮影した画像は一時ファイルに書き出し、セッションには参照だけを保持
                 if len(st.session_state.camera_images) == current_count:  # 新しい画像の場合
-                    st.session_state.camera_images.append(camera_image)
+                    job, pending = stage_images(
+                        [camera_image], save_dir, get_save_pipeline(), fsync_policy,
+                        source="camera", label=f"撮影画像{current_count + 1}の受け取り",
+                        processor=get_ingest_processor(), profile=ingest_profile
+                    )
+                    st.session_state.save_jobs.append(job)
+                    st.session_state.camera_images.extend(pending)
                     st.success(f"✅ {len(st.session_state.camera_images)}枚目の撮影完了！")
-                    if len(st.session_state.camera_images) < 2:
+                    if len(st.session_state.camera_images) < batch_limit:
                         st.info("🔄 次の写真を撮影するために、もう一度シャッターを押してください")
                     st.rerun()
         
@@ -122,26 +577,16 @@ def main():
             st.header("🖼️ 撮影した画像")
             
             # 画像プレビュー
-            if len(st.session_state.camera_images) == 1:
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.image(st.session_state.camera_images[0], caption="📸 撮影画像 1", use_column_width=True)
-                with col2:
-                    if current_count < 2:
-                        st.info("2枚目を撮影してください")
-                    
-            elif len(st.session_state.camera_images) == 2:
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.image(st.session_state.camera_images[0], caption="📸 撮影画像 1", use_column_width=True)
-                with col2:
-                    st.image(st.session_state.camera_images[1], caption="📸 撮影画像 2", use_column_width=True)
+            show_pending_preview(st.session_state.camera_images, thumbnail_cache, "📸 撮影画像")
+            if current_count < batch_limit:
+                st.info(f"あと{batch_limit - current_count}枚撮影できます")
             
             # 操作ボタン
             col1, col2, col3 = st.columns(3)
             
             with col1:
                 if st.button("🗑️ すべてクリア", type="secondary", use_container_width=True):
+                    discard_pending(st.session_state.camera_images)
                     st.session_state.camera_images = []
                     st.session_state.saved_camera_files = []
                     st.rerun()
@@ -149,135 +594,187 @@ def main():
             with col2:
                 if len(st.session_state.camera_images) > 0:
                     if st.button("📤 最後の1枚を削除", type="secondary", use_container_width=True):
-                        st.session_state.camera_images.pop()
+                        discard_pending([st.session_state.camera_images.pop()])
                         st.rerun()
             
             with col3:
-                if len(st.session_state.camera_images) == 2:
-                    if st.button("💾 2枚まとめて保存", type="primary", use_container_width=True):
-                        try:
-                            saved_files = []
-                            for i, img in enumerate(st.session_state.camera_images, 1):
-                                filepath = save_image_from_camera(img, save_dir, i)
-                                saved_files.append(filepath)
-                            
-                            st.session_state.saved_camera_files = saved_files
-                            st.success("✅ 2枚の画像が正常に保存されました！")
+                count = len(st.session_state.camera_images)
+                if st.button(f"💾 {count}枚まとめて保存", type="primary", use_container_width=True):
+                    try:
+                        # 一時ファイルへの書き込みが終わるのを待ってから rename でまとめて保存
+                        digests, perceptual_hashes, staging_errors = collect_staging_results()
+                        saved_files, save_errors = save_images_from_upload(
+                            st.session_state.camera_images, save_dir, fsync_policy, dedup_policy, digests,
+                            kind=storage_kind, staging_errors=staging_errors, perceptual_hashes=perceptual_hashes
+                        )
+                        
+                        st.session_state.camera_images = []
+                        st.session_state.saved_camera_files = saved_files
+                        if save_errors:
+                            show_save_errors(save_errors)
+                        if saved_files:
+                            st.success(f"✅ {len(saved_files)}枚の画像が正常に保存されました！")
                             st.balloons()
-                            
-                            # 保存されたファイル一覧を表示
-                            st.write("**保存されたファイル:**")
-                            for filepath in saved_files:
-                                st.write(f"- `{filepath}`")
-                            
-                            # ダウンロードボタンを追加
-                            st.write("**📥 ダウンロード:**")
-                            for i, (img, filepath) in enumerate(zip(st.session_state.camera_images, saved_files), 1):
-                                filename = os.path.basename(filepath)
-                                st.download_button(
-                                    label=f"📱 画像{i}をダウンロード",
-                                    data=img.getbuffer(),
-                                    file_name=filename,
-                                    mime="image/jpeg",
-                                    key=f"download_camera_{i}"
-                                )
-                            
-                        except Exception as e:
-                            st.error(f"❌ 保存中にエラーが発生しました: {str(e)}")
+                        
+                        # 保存されたファイル一覧を表示
+                        st.write("**保存されたファイル:**")
+                        for filepath in saved_files:
+                            st.write(f"- `{filepath}`")
+                        
+                        # ダウンロードボタンを追加
+                        show_saved_downloads(saved_files, "download_camera", backend)
+                        
+                    except Exception as e:
+                        st.error(f"❌ 保存中にエラーが発生しました: {str(e)}")
     
     elif mode == "ファイルをアップロード":
         st.header("📁 ファイルアップロードモード")
         
-        # ファイルアップローダー
+        remaining = batch_limit - len(st.session_state.upload_batch)
+        
+        # ファイルアップローダー（受け取ったらキーを変えて UploadedFile を解放する）
         uploaded_files = st.file_uploader(
-            "画像を選択してください（2枚まで）",
+            f"画像を選択してください（あと{max(remaining, 0)}枚まで）",
             type=['png', 'jpg', 'jpeg', 'gif', 'bmp'],
             accept_multiple_files=True,
-            help="ギャラリーから画像を選択できます"
+            help="ギャラリーから画像を選択できます",
+            key=f"uploader_{st.session_state.uploader_key}",
+            disabled=remaining <= 0
         )
         
         if uploaded_files:
             # アップロードされたファイル数をチェック
-            if len(uploaded_files) > 2:
-                st.warning("⚠️ 2枚までしか選択できません。最初の2枚のみ処理します。")
-                uploaded_files = uploaded_files[:2]
+            if len(uploaded_files) > remaining:
+                st.toast(f"⚠️ {batch_limit}枚までしか選択できません。最初の{remaining}枚のみ処理します。")
+                uploaded_files = uploaded_files[:remaining]
             
+            job, pending = stage_images(
+                uploaded_files, save_dir, get_save_pipeline(), fsync_policy,
+                source="upload", label=f"{len(uploaded_files)}枚のアップロードの受け取り",
+                processor=get_ingest_processor(), profile=ingest_profile
+            )
+            st.session_state.save_jobs.append(job)
+            st.session_state.upload_batch.extend(pending)
+            st.session_state.uploader_key += 1
+            st.rerun()
+        
+        upload_batch = st.session_state.upload_batch
+        if upload_batch:
             # 画像プレビュー
             st.header("🖼️ プレビュー")
-            
-            if len(uploaded_files) == 1:
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.image(uploaded_files[0], caption=f"画像1: {uploaded_files[0].name}", use_column_width=True)
-                with col2:
-                    st.info("もう1枚画像を選択してください")
-            
-            elif len(uploaded_files) == 2:
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.image(uploaded_files[0], caption=f"画像1: {uploaded_files[0].name}", use_column_width=True)
-                with col2:
-                    st.image(uploaded_files[1], caption=f"画像2: {uploaded_files[1].name}", use_column_width=True)
+            show_pending_preview(upload_batch, thumbnail_cache, "画像")
             
             # 画像情報を表示
             st.header("ℹ️ 画像情報")
-            for i, file in enumerate(uploaded_files, 1):
-                with st.expander(f"画像{i}の詳細"):
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.write(f"**ファイル名:** {file.name}")
-                    with col2:
-                        st.write(f"**サイズ:** {file.size / 1024:.1f} KB")
-                    with col3:
-                        try:
-                            image = Image.open(file)
-                            st.write(f"**解像度:** {image.size[0]} × {image.size[1]}")
-                        except:
-                            st.write("**解像度:** 取得できません")
+            rows = []
+            for i, pending in enumerate(upload_batch, 1):
+                try:
+                    width, height = probe_image(pending.staged_path).display_size
+                    resolution = f"{width} × {height}"
+                except Exception:
+                    resolution = "取得できません"
+                rows.append({
+                    "No.": i,
+                    "ファイル名": pending.name,
+                    "サイズ (KB)": round(pending.size / 1024, 1),
+                    "解像度": resolution,
+                })
+            st.dataframe(rows, hide_index=True, use_container_width=True)
             
             # 保存ボタン
             st.header("💾 保存")
             
-            if len(uploaded_files) == 2:
-                if st.button("🔄 2枚の画像を保存", type="primary", use_container_width=True):
-                    try:
-                        saved_files = save_images_from_upload(uploaded_files, save_dir)
-                        st.success("✅ 画像が正常に保存されました！")
-                        
-                        st.write("**保存されたファイル:**")
-                        for filepath in saved_files:
-                            st.write(f"- `{filepath}`")
-                        
-                        # ダウンロードボタンを追加
-                        st.write("**📥 ダウンロード:**")
-                        for i, (uploaded_file, filepath) in enumerate(zip(uploaded_files, saved_files), 1):
-                            filename = os.path.basename(filepath)
-                            st.download_button(
-                                label=f"📱 画像{i}をダウンロード",
-                                data=uploaded_file.getbuffer(),
-                                file_name=filename,
-                                mime=f"image/{uploaded_file.type.split('/')[-1]}",
-                                key=f"download_upload_{i}"
-                            )
-                        
-                        st.balloons()
-                        
-                    except Exception as e:
-                        st.error(f"❌ 保存中にエラーが発生しました: {str(e)}")
-            else:
-                st.info("📝 2枚の画像を選択してから保存ボタンが有効になります")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🗑️ すべてクリア", type="secondary", use_container_width=True, key="clear_upload_batch"):
+                    discard_pending(upload_batch)
+                    st.session_state.upload_batch = []
+                    st.rerun()
+            
+            with col2:
+                save_clicked = st.button(f"🔄 {len(upload_batch)}枚の画像を保存", type="primary", use_container_width=True)
+            
+            if save_clicked:
+                try:
+                    # 一時ファイルへの書き込みが終わるのを待ってから rename でまとめて保存
+                    digests, perceptual_hashes, staging_errors = collect_staging_results()
+                    saved_files, save_errors = save_images_from_upload(
+                        upload_batch, save_dir, fsync_policy, dedup_policy, digests, kind=storage_kind,
+                        staging_errors=staging_errors, perceptual_hashes=perceptual_hashes
+                    )
+                    st.session_state.upload_batch = []
+                    if save_errors:
+                        show_save_errors(save_errors)
+                    st.success(f"✅ {len(saved_files)}枚の画像が正常に保存されました！")
+                    
+                    st.write("**保存されたファイル:**")
+                    for filepath in saved_files:
+                        st.write(f"- `{filepath}`")
+                    
+                    # ダウンロードボタンを追加
+                    show_saved_downloads(saved_files, "download_upload", backend)
+                    
+                    st.balloons()
+                    
+                except Exception as e:
+                    st.error(f"❌ 保存中にエラーが発生しました: {str(e)}")
+        else:
+            st.info(f"📝 画像を選択すると、{batch_limit}枚までまとめて保存できます")
+    
+    elif mode == "保存済み画像を表示" and storage_kind == "s3":
+        st.header("🖼️ 保存済み画像ギャラリー（S3）")
+        show_remote_gallery(backend)
     
     elif mode == "保存済み画像を表示":
         st.header("🖼️ 保存済み画像ギャラリー")
         
+        # 一覧を読む前のバージョンを覚えておき、それ以降の変更だけを監視で拾う
+        watcher = get_directory_watcher(save_dir)
+        watcher.wait_ready()
+        st.session_state.gallery_version = watcher.version
+        watch_gallery(watcher)
+        get_trash_purger(save_dir)
+        
         # 保存済み画像を取得
-        saved_images = get_saved_images(save_dir)
+        total_count = count_saved_images(save_dir)
+        
+        # 似ている画像
+        if st.session_state.similar_to is not None:
+            show_similar_images(save_dir, thumbnail_cache)
+        
+        # 直前の削除結果
+        last_delete = st.session_state.last_delete
+        if last_delete is not None:
+            if last_delete.moved:
+                col_msg, col_undo = st.columns([3, 1])
+                with col_msg:
+                    st.success(f"✅ {len(last_delete.moved)} 枚の画像をゴミ箱に移動しました")
+                with col_undo:
+                    if st.button("↩️ 元に戻す", use_container_width=True):
+                        result = restore_deleted_images(last_delete.moved, save_dir)
+                        st.session_state.last_delete = None
+                        if result.errors:
+                            st.error(f"❌ {len(result.errors)} 枚を元に戻せませんでした")
+                        else:
+                            st.rerun()
+            if last_delete.errors:
+                st.error(f"❌ {len(last_delete.errors)} 枚の画像を削除できませんでした")
+                with st.expander("失敗したファイル"):
+                    for filepath, error in last_delete.errors:
+                        st.write(f"- `{filepath}`: {error}")
         
-        if not saved_images:
+        if total_count == 0:
             st.info(f"📂 `{save_dir}` フォルダに保存された画像がありません")
             st.write("カメラ撮影またはファイルアップロードで画像を保存してください。")
         else:
-            st.write(f"**📊 合計 {len(saved_images)} 枚の画像が保存されています**")
+            duplicate_files, duplicate_bytes = get_image_index(save_dir).duplicate_stats()
+            if duplicate_files:
+                st.write(
+                    f"**📊 合計 {total_count} 枚の画像が保存されています**"
+                    f"（♻️ 重複 {duplicate_files} 枚分、{duplicate_bytes / 1024 / 1024:.1f} MB を節約）"
+                )
+            else:
+                st.write(f"**📊 合計 {total_count} 枚の画像が保存されています**")
             
             # 表示方法の選択
             display_mode = st.radio(
@@ -286,6 +783,80 @@ def main():
                 horizontal=True
             )
             
+            # ページ送りと期間での絞り込み（表示中のページだけを読み込む）
+            col_size, col_range = st.columns([1, 2])
+            with col_size:
+                page_size = st.selectbox("1ページの表示枚数", [10, 20, 50, 100], index=1)
+            with col_range:
+                date_range = st.date_input("保存日で絞り込み", value=(), help="開始日と終了日を選択してください")
+            
+            start_time = end_time = None
+            if len(date_range) >= 1:
+                start_time = datetime.combine(date_range[0], datetime.min.time()).timestamp()
+                end_date = date_range[1] if len(date_range) == 2 else date_range[0]
+                end_time = datetime.combine(end_date + timedelta(days=1), datetime.min.time()).timestamp()
+            
+            filtered_count = count_saved_images(save_dir, start_time, end_time)
+            total_pages = max(1, (filtered_count + page_size - 1) // page_size)
+            
+            col_page, col_info = st.columns([1, 2])
+            with col_page:
+                page = st.number_input("ページ", min_value=1, max_value=total_pages, value=1, step=1)
+            with col_info:
+                st.write("　")  # スペーサー
+                if start_time is not None:
+                    st.caption(f"🔎 該当 {filtered_count} 枚 | {page}/{total_pages} ページ")
+                else:
+                    st.caption(f"📄 {page}/{total_pages} ページ")
+            
+            saved_images = get_saved_image_records(
+                save_dir, start_time, end_time, limit=page_size, offset=(page - 1) * page_size
+            )
+            if not saved_images:
+                st.info("🔎 条件に一致する画像がありません")
+            
+            # 複数選択
+            selected = st.session_state.selected_images
+            col_count, col_page_sel, col_all_sel, col_clear, col_delete_sel = st.columns(5)
+            with col_count:
+                st.write(f"✅ **{len(selected)} 枚選択中**")
+            with col_page_sel:
+                st.button(
+                    "このページを選択", use_container_width=True,
+                    on_click=set_selection, args=(selected | {record.path for record in saved_images},)
+                )
+            with col_all_sel:
+                st.button(
+                    "絞り込み結果を選択", use_container_width=True,
+                    on_click=select_filtered, args=(save_dir, start_time, end_time)
+                )
+            with col_clear:
+                st.button("選択を解除", use_container_width=True, on_click=set_selection, args=((),))
+            with col_delete_sel:
+                if st.button("🗑️ 選択を削除", use_container_width=True, disabled=not selected):
+                    st.session_state.pending_delete = "selected"
+            
+            # 削除の確認（再実行をまたいで表示される）
+            if st.session_state.pending_delete is not None:
+                delete_all = st.session_state.pending_delete == "all"
+                delete_count = total_count if delete_all else len(selected)
+                st.warning(
+                    f"⚠️ {'全ての' if delete_all else '選択した'}画像 {delete_count} 枚をゴミ箱に移動します。"
+                    "ゴミ箱の画像は7日後に完全に削除されます。"
+                )
+                col_confirm, col_cancel = st.columns(2)
+                with col_confirm:
+                    if st.button("🗑️ 削除する", type="primary", use_container_width=True):
+                        targets = get_saved_images(save_dir) if delete_all else sorted(selected)
+                        st.session_state.last_delete = delete_image_files(targets, save_dir)
+                        st.session_state.pending_delete = None
+                        set_selection(())
+                        st.rerun()
+                with col_cancel:
+                    if st.button("キャンセル", use_container_width=True):
+                        st.session_state.pending_delete = None
+                        st.rerun()
+            
             if display_mode == "グリッド表示":
                 # グリッド表示（2列）
                 cols_per_row = 2
@@ -294,89 +865,119 @@ def main():
                     
                     for j in range(cols_per_row):
                         if i + j < len(saved_images):
-                            filepath = saved_images[i + j]
-                            filename = os.path.basename(filepath)
+                            record = saved_images[i + j]
+                            filepath = record.path
+                            filename = record.name
                             
                             with cols[j]:
                                 try:
-                                    # 画像を表示
-                                    image = Image.open(filepath)
-                                    st.image(image, caption=filename, use_column_width=True)
+                                    # サムネイルを表示（原寸はチェック時のみ読み込む）
+                                    st.image(thumbnail_cache.get(filepath), caption=filename, use_column_width=True)
                                     
-                                    # 画像情報
-                                    file_size = os.path.getsize(filepath) / 1024  # KB
-                                    modify_time = datetime.fromtimestamp(os.path.getmtime(filepath))
+                                    # 画像情報（インデックスから取得）
+                                    file_size = record.size / 1024  # KB
+                                    modify_time = datetime.fromtimestamp(record.mtime)
                                     
-                                    st.caption(f"📏 {image.size[0]}×{image.size[1]} | 💾 {file_size:.1f}KB")
+                                    width, height = record.display_size
+                                    st.caption(f"📏 {width}×{height} | 💾 {file_size:.1f}KB")
                                     st.caption(f"🕒 {modify_time.strftime('%Y/%m/%d %H:%M')}")
                                     
                                     # ボタン
-                                    col_download, col_delete = st.columns(2)
+                                    col_select, col_download, col_similar, col_delete = st.columns(4)
+                                    
+                                    with col_select:
+                                        select_key = f"select_{filepath}"
+                                        st.checkbox(
+                                            "選択", value=filepath in selected, key=select_key,
+                                            on_change=toggle_selection, args=(filepath, select_key)
+                                        )
                                     
                                     with col_download:
-                                        with open(filepath, "rb") as file:
-                                            st.download_button(
-                                                label="📥",
-                                                data=file.read(),
-                                                file_name=filename,
-                                                mime=f"image/{filepath.split('.')[-1].lower()}",
-                                                key=f"download_grid_{i}_{j}",
-                                                help="ダウンロード"
-                                            )
+                                        st.download_button(
+                                            label="📥",
+                                            data=partial(read_image_bytes, filepath),
+                                            file_name=os.path.basename(filename),
+                                            mime=f"image/{filepath.split('.')[-1].lower()}",
+                                            key=f"download_grid_{i}_{j}",
+                                            help="ダウンロード"
+                                        )
+                                    
+                                    with col_similar:
+                                        st.button(
+                                            "🔎", key=f"similar_grid_{i}_{j}", help="似ている画像を探す",
+                                            on_click=show_similar, args=(filepath,)
+                                        )
                                     
                                     with col_delete:
                                         if st.button("🗑️", key=f"delete_grid_{i}_{j}", help="削除"):
-                                            if delete_image_file(filepath):
+                                            if delete_image_file(filepath, save_dir):
                                                 st.success(f"✅ {filename} を削除しました")
                                                 st.rerun()
                                             else:
                                                 st.error(f"❌ {filename} の削除に失敗しました")
+                                    
+                                    if st.checkbox("🔍 原寸表示", key=f"fullres_grid_{filename}"):
+                                        st.image(read_image_bytes(filepath), use_column_width=True)
                                 
                                 except Exception as e:
                                     st.error(f"❌ 画像の読み込みエラー: {filename}")
             
             else:  # リスト表示
                 st.write("---")
-                for i, filepath in enumerate(saved_images):
-                    filename = os.path.basename(filepath)
+                for i, record in enumerate(saved_images):
+                    filepath = record.path
+                    filename = record.name
                     
                     with st.expander(f"📸 {filename}", expanded=False):
                         try:
                             col1, col2 = st.columns([1, 2])
                             
                             with col1:
-                                # 画像表示
-                                image = Image.open(filepath)
-                                st.image(image, use_column_width=True)
+                                # サムネイル表示（原寸はチェック時のみ読み込む）
+                                st.image(thumbnail_cache.get(filepath), use_column_width=True)
+                                if st.checkbox("🔍 原寸表示", key=f"fullres_list_{filename}"):
+                                    st.image(read_image_bytes(filepath), use_column_width=True)
                             
                             with col2:
-                                # 詳細情報
-                                file_size = os.path.getsize(filepath) / 1024  # KB
-                                modify_time = datetime.fromtimestamp(os.path.getmtime(filepath))
+                                select_key = f"select_{filepath}"
+                                st.checkbox(
+                                    "選択", value=filepath in selected, key=select_key,
+                                    on_change=toggle_selection, args=(filepath, select_key)
+                                )
+                                
+                                # 詳細情報（インデックスから取得）
+                                file_size = record.size / 1024  # KB
+                                modify_time = datetime.fromtimestamp(record.mtime)
+                                width, height = record.display_size
                                 
                                 st.write(f"**📁 ファイル名:** {filename}")
-                                st.write(f"**📏 解像度:** {image.size[0]} × {image.size[1]} px")
+                                st.write(f"**📏 解像度:** {width} × {height} px")
                                 st.write(f"**💾 ファイルサイズ:** {file_size:.1f} KB")
                                 st.write(f"**🕒 保存日時:** {modify_time.strftime('%Y年%m月%d日 %H:%M:%S')}")
                                 st.write(f"**📂 パス:** `{filepath}`")
                                 
                                 # アクションボタン
-                                col_btn1, col_btn2 = st.columns(2)
+                                col_btn1, col_btn2, col_btn3 = st.columns(3)
                                 
                                 with col_btn1:
-                                    with open(filepath, "rb") as file:
-                                        st.download_button(
-                                            label="📥 ダウンロード",
-                                            data=file.read(),
-                                            file_name=filename,
-                                            mime=f"image/{filepath.split('.')[-1].lower()}",
-                                            key=f"download_list_{i}",
-                                            use_container_width=True
-                                        )
+                                    st.download_button(
+                                        label="📥 ダウンロード",
+                                        data=partial(read_image_bytes, filepath),
+                                        file_name=os.path.basename(filename),
+                                        mime=f"image/{filepath.split('.')[-1].lower()}",
+                                        key=f"download_list_{i}",
+                                        use_container_width=True
+                                    )
                                 
                                 with col_btn2:
+                                    st.button(
+                                        "🔎 似ている画像", key=f"similar_list_{i}", use_container_width=True,
+                                        on_click=show_similar, args=(filepath,)
+                                    )
+                                
+                                with col_btn3:
                                     if st.button("🗑️ 削除", key=f"delete_list_{i}", use_container_width=True):
-                                        if delete_image_file(filepath):
+                                        if delete_image_file(filepath, save_dir):
                                             st.success(f"✅ {filename} を削除しました")
                                             st.rerun()
                                         else:
@@ -392,57 +993,118 @@ def main():
             col1, col2, col3 = st.columns(3)
             
             with col1:
+                # 通常はフォルダ監視で自動的に更新される。取りこぼした時のためにフォルダ全体を走査し直す
                 if st.button("🔄 リロード", use_container_width=True):
+                    get_image_index(save_dir).reconcile(force=True)
                     st.rerun()
             
             with col2:
-                # 全画像のZIPダウンロード機能も追加可能
-                st.write("　")  # スペーサー
+                # ZIPはボタンが押された時にだけ作成する
+                zip_scope = st.selectbox(
+                    "ZIPの対象",
+                    ["全画像", "絞り込み結果", "表示中のページ", "選択した画像"],
+                    label_visibility="collapsed"
+                )
+                index = get_image_index(save_dir)
+                missing_count = 0
+                if zip_scope == "選択した画像":
+                    # 他のセッションで削除された画像は含めない
+                    selected_sizes = index.sizes(selected)
+                    missing_count = len(selected) - len(selected_sizes)
+                    zip_bytes = sum(selected_sizes.values())
+                    zip_data = partial(build_zip_archive, sorted(selected_sizes))
+                elif zip_scope == "表示中のページ":
+                    zip_bytes = sum(record.size for record in saved_images)
+                    zip_data = partial(build_zip_archive, [record.path for record in saved_images])
+                elif zip_scope == "絞り込み結果":
+                    zip_bytes = index.total_size(start_time, end_time)
+                    zip_data = partial(build_gallery_zip, index, start_time, end_time)
+                else:
+                    zip_bytes = index.total_size()
+                    zip_data = partial(build_gallery_zip, index)
+                
+                st.download_button(
+                    label="📦 ZIPでダウンロード",
+                    data=zip_data,
+                    file_name=f"{os.path.basename(os.path.normpath(save_dir))}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                    mime="application/zip",
+                    use_container_width=True,
+                    disabled=zip_bytes > MAX_BROWSER_ZIP_BYTES
+                )
+                if zip_bytes > MAX_BROWSER_ZIP_BYTES:
+                    st.caption(
+                        f"⚠️ {zip_bytes / 1024 / 1024:.0f} MB はブラウザからのダウンロードの上限"
+                        f"（{MAX_BROWSER_ZIP_BYTES // 1024 // 1024} MB）を超えています。"
+                        f"`python main.py --save-dir {save_dir} export 画像.zip` でファイルに書き出してください"
+                    )
+                if missing_count:
+                    st.caption(f"⚠️ 選択した画像のうち {missing_count} 枚は見つからないため含めません")
             
             with col3:
-                if len(saved_images) > 0:
+                if total_count > 0:
                     if st.button("⚠️ 全て削除", type="secondary", use_container_width=True):
-                        # 確認ダイアログを表示
-                        st.warning("⚠️ この操作は元に戻せません。本当に全ての画像を削除しますか？")
-                        if st.button("🗑️ 本当に全て削除", type="secondary"):
-                            deleted_count = 0
-                            for filepath in saved_images:
-                                if delete_image_file(filepath):
-                                    deleted_count += 1
-                            
-                            if deleted_count > 0:
-                                st.success(f"✅ {deleted_count} 枚の画像を削除しました")
-                                st.rerun()
-                            else:
-                                st.error("❌ 画像の削除に失敗しました")
+                        # 確認は一覧の上に表示する
+                        st.session_state.pending_delete = "all"
+                        st.rerun()
+    
+    # 共有キャッシュの利用状況
+    cache_stats = get_file_cache().stats()
+    if cache_stats.hits + cache_stats.misses:
+        hit_rate = cache_stats.hits / (cache_stats.hits + cache_stats.misses) * 100
+        st.sidebar.caption(
+            f"🗃️ 画像キャッシュ: ヒット率 {hit_rate:.0f}%（{cache_stats.hits}/{cache_stats.hits + cache_stats.misses}）"
+            f" | {cache_stats.entries} 件・{cache_stats.memory_bytes / 1024 / 1024:.1f} MB"
+        )
+    
+    # バックグラウンド保存の進捗
+    if st.session_state.save_jobs:
+        with st.sidebar:
+            st.header("💾 保存状況")
+            show_save_progress()
     
     # 使い方説明
     with st.expander("💡 使い方ガイド"):
-        st.markdown("""
+        st.markdown(f"""
         ### 📷 カメラ撮影モード
         1. サイドバーで「カメラで直接撮影」を選択
         2. シャッターボタンを押して1枚目を撮影
-        3. もう一度シャッターボタンを押して2枚目を撮影
-        4. 「2枚まとめて保存」ボタンをクリック
+        3. 続けてシャッターボタンを押し、設定した枚数まで撮影
+        4. 「まとめて保存」ボタンをクリック
         
         ### 📁 ファイルアップロードモード
         1. サイドバーで「ファイルをアップロード」を選択
-        2. ギャラリーから画像を2枚選択
+        2. ギャラリーから画像を選択（設定した枚数まで、何回かに分けて追加も可能）
         3. プレビューで確認
-        4. 「2枚の画像を保存」ボタンをクリック
+        4. 「画像を保存」ボタンをクリック
         
         ### 🖼️ 保存済み画像表示モード
         1. サイドバーで「保存済み画像を表示」を選択
-        2. **グリッド表示**: 画像を2列で一覧表示
+        2. **グリッド表示**: 画像を2列で一覧表示（ページ単位で表示、保存日で絞り込み可能）
         3. **リスト表示**: 画像を詳細情報と共に表示
-        4. 各画像の「📥ダウンロード」「🗑️削除」が可能
+        4. 各画像の「📥ダウンロード」「🗑️削除」が可能（「選択」で複数枚をまとめて削除・ZIP化）
+        5. 「📦 ZIPでダウンロード」で全画像・絞り込み結果・表示中のページをまとめて保存（{MAX_BROWSER_ZIP_BYTES // 1024 // 1024} MB まで。見つからなかった画像は ZIP 内の `{MISSING_FILES_NAME}` に記載）
+        6. 一覧はサムネイルで表示され、「🔍 原寸表示」で元の解像度を確認できます
+        7. フォルダに追加・削除された画像は自動的に一覧へ反映されます
+        8. 「🔎」で、その画像に似ている画像（連写や同じ被写体の写真など）を近い順に表示します
         
         ### 📝 注意事項
         - カメラ撮影では画像はJPG形式で保存されます
         - アップロードでは元の形式が保持されます
+        - サイドバーの画質プロファイルを選ぶと、保存前に縮小や JPEG/WebP への変換を行います
+        - 保存済みの画像と同じ内容の画像は、設定に応じて保存を省くかハードリンクにします（以前からフォルダにある画像は「♻️ まとめて計算」か `python main.py hash` で内容のハッシュを計算できます）
         - ファイル名にはタイムスタンプが自動で付きます
-        - 削除した画像は復元できません
+        - まとめて保存する枚数はサイドバーの設定で変更できます（初期値は2枚）
+        - 削除した画像はゴミ箱（保存フォルダ内の `.trash`）に移動し、7日後に完全に削除されます
+        - 「保存先フォルダの分け方」で、保存日ごと・ハッシュごとのサブフォルダに分けて保存できます（既存の画像は「📂 移動」で移せます）
+        - 環境変数 `IMAGE_SAVE_S3_BUCKET` を設定すると、保存先に S3 互換のストレージ（MinIO など）を選べます（boto3 が必要、`IMAGE_SAVE_S3_ENDPOINT_URL`・`IMAGE_SAVE_S3_PREFIX` で接続先と置き場所を指定）
+        - 「⏱️ 処理時間を計測」をオンにすると、サイドバーに再実行ごとの処理時間の内訳が表示されます
         """)
+    
+    # 処理時間の内訳
+    if recorder is not None:
+        show_timing_panel(recorder)
+    if metrics_file and metrics.is_enabled():
+        metrics.write_prometheus(metrics_file)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""画像の保存・一覧・削除・メタデータ取得を行うライブラリ
+
+Streamlit には依存せず、Pillow も変換やサムネイル作成が必要になった時に読み込む。
+"""
+from .backends import LocalBackend, S3Backend, StorageBackend
+from .image_index import ImageIndex, ImageRecord
+from .image_probe import ImageInfo, probe_image
+from .layout import LAYOUTS, read_layout, write_layout
+from .perceptual_hash import SimilarImageIndex, hash_images
+from .storage import (
+    DEDUP_POLICIES, backfill_content_hashes, backfill_perceptual_hashes, count_saved_images, delete_images,
+    find_image_files, import_files, list_saved_images, migrate_layout, prune, restore_images, save_images,
+)
@@ -0,0 +1,271 @@
+import io
+import mimetypes
+import os
+import uuid
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import metrics
+from .batch_staging import PendingImage, discard_pending
+from .image_index import is_image_filename
+from .save_pipeline import atomic_write
+from .storage import camera_image_path, delete_images, list_saved_images, save_images, upload_image_path
+from .trash import TrashResult
+
+# 一覧の1件分（key: 保存先でのキー / size: バイト数 / mtime: 更新時刻の UNIX 時刻）
+ObjectInfo = namedtuple("ObjectInfo", ["key", "size", "mtime"])
+
+# 一覧の1ページ分（next_token が None なら最後のページ）
+ListPage = namedtuple("ListPage", ["objects", "next_token"])
+
+# S3 の DeleteObjects で一度に削除できる件数
+_DELETE_BATCH_SIZE = 1000
+
+
+class StorageBackend(ABC):
+    """画像の保存先の共通インターフェース
+
+    一覧は list_page でページ単位に取得し、next_token を渡して続きを読む
+    （全件のキーを一度に読み込まない）。キーの形式と一覧の順序は実装ごとに異なる。
+    """
+
+    def save_images(self, uploaded_files, start_number=1, source="upload", staging_errors=None, **options):
+        """カメラ/アップロードの画像を保存し、(保存先のキーのリスト, 失敗のリスト) を返す
+
+        受け取りに失敗した保存待ち画像（staging_errors にある一時ファイル）は保存せず、
+        (ファイル名, エラーメッセージ) を失敗のリストに入れる。
+        上書きを確かめずに保存する実装でも、同じ秒に別のセッションが保存した画像と
+        キーが重ならないよう、キーの末尾にランダムな8桁を付ける。
+        fsync・dedup などローカル保存用の指定は、対応しない実装では無視する。
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        items = []
+        names = {}
+        errors = []
+        try:
+            for i, uploaded_file in enumerate(uploaded_files, start_number):
+                name = getattr(uploaded_file, "name", None) or f"{source}.jpg"
+                if isinstance(uploaded_file, PendingImage) and uploaded_file.staged_path in (staging_errors or {}):
+                    errors.append((name, staging_errors[uploaded_file.staged_path]))
+                    continue
+                item_source = uploaded_file.source if isinstance(uploaded_file, PendingImage) else source
+                if item_source == "camera":
+                    key = camera_image_path("", i, timestamp, name.split('.')[-1])
+                else:
+                    key = upload_image_path("", name, i, timestamp)
+                stem, ext = os.path.splitext(key)
+                key = f"{stem}_{uuid.uuid4().hex[:8]}{ext}"
+                names[key] = name
+                if isinstance(uploaded_file, PendingImage):
+                    items.append((key, uploaded_file.staged_path))
+                else:
+                    items.append((key, uploaded_file.getbuffer()))
+            keys, put_errors = self.put_many(items)
+            errors.extend((names[key], error) for key, error in put_errors)
+        finally:
+            # 保存できなかった画像も含め、一時ファイルは必ず片付ける
+            discard_pending([uploaded_file for uploaded_file in uploaded_files if isinstance(uploaded_file, PendingImage)])
+        return keys, errors
+
+    @abstractmethod
+    def put(self, key, source):
+        """画像を1枚保存して保存先のキーを返す（source はファイルのパスかバイト列）"""
+
+    def put_many(self, items):
+        """(キー, ファイルのパスかバイト列) のリストをまとめて保存し、(保存したキーのリスト, 失敗のリスト) を返す
+
+        1枚の失敗で残りを止めず、(キー, エラーメッセージ) を失敗のリストに入れる。
+        """
+        keys = []
+        errors = []
+        for key, source in items:
+            try:
+                keys.append(self.put(key, source))
+            except Exception as e:
+                errors.append((key, getattr(e, "strerror", None) or str(e)))
+        return keys, errors
+
+    @abstractmethod
+    def get(self, key):
+        """画像の内容をバイト列で取得"""
+
+    def get_many(self, keys):
+        """複数の画像の内容を取得"""
+        return [self.get(key) for key in keys]
+
+    @abstractmethod
+    def delete_images(self, keys):
+        """画像をまとめて削除し、キーごとの結果（TrashResult）を返す"""
+
+    @abstractmethod
+    def list_page(self, page_size=100, token=None):
+        """画像の一覧を1ページ分取得"""
+
+    def iter_objects(self, page_size=1000):
+        """全ての画像をページ単位で読みながら順に返す"""
+        token = None
+        while True:
+            page = self.list_page(page_size, token)
+            yield from page.objects
+            if page.next_token is None:
+                return
+            token = page.next_token
+
+    def close(self):
+        pass
+
+
+class LocalBackend(StorageBackend):
+    """保存フォルダ（ローカルのファイルシステム）への保存
+
+    キーはファイルのパス。保存・削除・一覧はインデックスとゴミ箱を使う
+    storage の関数をそのまま使い、一覧はインデックスから新しい順に読む。
+    """
+
+    def __init__(self, index, file_cache=None):
+        self.index = index
+        self.save_directory = index.save_directory
+        self.file_cache = file_cache
+
+    def save_images(self, uploaded_files, start_number=1, source="upload", staging_errors=None, fsync="none",
+                    dedup="off", digests=None, perceptual_hashes=None):
+        return save_images(
+            uploaded_files, self.index, fsync, dedup, digests, start_number, source, file_cache=self.file_cache,
+            staging_errors=staging_errors, perceptual_hashes=perceptual_hashes,
+        )
+
+    def put(self, key, source):
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        filepath = atomic_write(key, source, exclusive=True).path
+        self.index.add(filepath)
+        return filepath
+
+    def get(self, key):
+        if self.file_cache is not None:
+            return self.file_cache.get(key)
+        with open(key, "rb") as f:
+            return f.read()
+
+    def delete_images(self, keys):
+        return delete_images(keys, self.index, self.file_cache)
+
+    def list_page(self, page_size=100, token=None):
+        """インデックスから新しい順に1ページ分を取得（token は読み始める位置）"""
+        offset = token or 0
+        records = list_saved_images(self.index, limit=page_size, offset=offset)
+        objects = [ObjectInfo(record.path, record.size, record.mtime) for record in records]
+        return ListPage(objects, offset + len(objects) if len(objects) == page_size else None)
+
+
+class S3Backend(StorageBackend):
+    """S3 互換のオブジェクトストレージ（AWS S3・MinIO など）への保存
+
+    boto3 が必要（pip install ".[s3]"）。クライアントは接続プールを持ち、全スレッドで共有する。
+    大きな画像はマルチパートで分割してアップロードし、複数の画像はスレッドプールで並列に転送する。
+    キーは prefix を除いたオブジェクトのキー。ListObjectsV2 はキーの辞書順でしか返せないため、
+    一覧は保存フォルダのような新しい順ではなく、保存元（camera_image_ / upload_image_）ごとに古い順になる。
+    """
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region_name=None, max_concurrency=8,
+                 max_pool_connections=32, multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError as e:
+            raise ImportError("S3 に保存するには boto3 が必要です（pip install boto3）") from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.max_concurrency = max_concurrency
+        # 並列の転送それぞれが接続を使うため、プールは転送の同時実行数より大きくする
+        self._client = boto3.session.Session().client(
+            "s3", endpoint_url=endpoint_url, region_name=region_name,
+            config=Config(max_pool_connections=max_pool_connections, retries={"max_attempts": 5, "mode": "adaptive"}),
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize,
+            max_concurrency=max(1, max_pool_connections // max_concurrency), use_threads=True,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="s3-transfer")
+
+    def _object_key(self, key):
+        return self.prefix + key
+
+    @metrics.timed("s3_put")
+    def put(self, key, source):
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        extra_args = {"ContentType": content_type}
+        if isinstance(source, str):
+            # ファイルから直接アップロードし、閾値を超える画像はマルチパートで送る
+            self._client.upload_file(
+                source, self.bucket, self._object_key(key), ExtraArgs=extra_args, Config=self._transfer_config,
+            )
+        else:
+            self._client.upload_fileobj(
+                io.BytesIO(source), self.bucket, self._object_key(key), ExtraArgs=extra_args,
+                Config=self._transfer_config,
+            )
+        metrics.count("s3_put_objects")
+        return key
+
+    def put_many(self, items):
+        futures = [(key, self._executor.submit(self.put, key, source)) for key, source in items]
+        keys = []
+        errors = []
+        for key, future in futures:
+            try:
+                keys.append(future.result())
+            except Exception as e:
+                errors.append((key, getattr(e, "strerror", None) or str(e)))
+        return keys, errors
+
+    @metrics.timed("s3_get")
+    def get(self, key):
+        # download_fileobj は大きさを調べる HEAD が毎回増えるため、画像程度の大きさなら GET 1回で読む
+        response = self._client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        with response["Body"] as body:
+            data = body.read()
+        metrics.count("s3_get_bytes", len(data))
+        return data
+
+    def get_many(self, keys):
+        return list(self._executor.map(self.get, keys))
+
+    @metrics.timed("s3_delete")
+    def delete_images(self, keys):
+        """オブジェクトをまとめて削除（ゴミ箱は無いため元に戻せない）"""
+        keys = list(keys)
+        failed = {}
+        for start in range(0, len(keys), _DELETE_BATCH_SIZE):
+            batch = keys[start:start + _DELETE_BATCH_SIZE]
+            response = self._client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self._object_key(key)} for key in batch], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                failed[error["Key"][len(self.prefix):]] = error.get("Message") or error.get("Code")
+        moved = [(key, None) for key in keys if key not in failed]
+        return TrashResult(moved, list(failed.items()))
+
+    @metrics.timed("s3_list")
+    def list_page(self, page_size=100, token=None):
+        """ListObjectsV2 で1ページ分をキーの順に取得（token は前のページの継続トークン）"""
+        params = {"Bucket": self.bucket, "Prefix": self.prefix, "MaxKeys": page_size}
+        if token is not None:
+            params["ContinuationToken"] = token
+        response = self._client.list_objects_v2(**params)
+        objects = [
+            ObjectInfo(item["Key"][len(self.prefix):], item["Size"], item["LastModified"].timestamp())
+            for item in response.get("Contents", [])
+            if is_image_filename(item["Key"])
+        ]
+        return ListPage(objects, response.get("NextContinuationToken") if response.get("IsTruncated") else None)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._client.close()
@@ -0,0 +1,79 @@
+import os
+import time
+import uuid
+from collections import namedtuple
+from functools import partial
+
+from .image_probe import probe_image
+from .ingest import INGEST_PROFILES, is_passthrough, output_filename
+
+# 保存フォルダ内に作る、保存前の画像を置いておくディレクトリ
+STAGING_DIR_NAME = ".staging"
+
+# セッションに保持する保存待ち画像。バッファは持たずに一時ファイルを参照する
+PendingImage = namedtuple("PendingImage", ["name", "size", "mime", "staged_path", "source"])
+
+
+def staging_directory(save_directory):
+    """保存待ち画像の置き場所"""
+    return os.path.join(save_directory, STAGING_DIR_NAME)
+
+
+def stage_images(files, save_directory, pipeline, fsync="none", source="upload", label="受け取り",
+                 processor=None, profile=INGEST_PROFILES["original"]):
+    """カメラ/アップロードの画像を一時ファイルに書き出し、参照と保存ジョブを返す
+
+    書き込みは保存パイプラインで行うため、この関数はすぐに戻る。
+    同じフォルダ内に置くので、本保存は rename だけで済む。SHA-256 と知覚ハッシュも
+    書き込みと一緒に計算し、保存ジョブの digests・perceptual_hashes に入れる。
+    processor と profile を渡すと、書き込む前にプロセスプールで縮小・形式変換する。
+    """
+    directory = staging_directory(save_directory)
+    job = pipeline.new_job(len(files), label=label)
+    transform = None
+    if processor is not None and not is_passthrough(profile):
+        transform = partial(processor.transcode, profile=profile)
+
+    pending = []
+    for uploaded_file in files:
+        name = getattr(uploaded_file, "name", None) or f"{source}.jpg"
+        if transform is not None:
+            # 変換後の形式はヘッダーだけで決まるので、拡張子は先に付け替えておく
+            try:
+                name = output_filename(name, probe_image(uploaded_file).format, profile)
+            except Exception:
+                pass
+        ext = os.path.splitext(name)[1].lower() or ".jpg"
+        staged_path = os.path.join(directory, f"{uuid.uuid4().hex}{ext}")
+        data = uploaded_file.getvalue()
+        pipeline.submit(job, data, staged_path, fsync, transform=transform, perceptual_hash=True)
+        pending.append(PendingImage(name, len(data), getattr(uploaded_file, "type", None), staged_path, source))
+    return job, pending
+
+
+def discard_pending(pending_images):
+    """保存しなかった画像の一時ファイルを削除"""
+    for pending in pending_images:
+        try:
+            os.remove(pending.staged_path)
+        except OSError:
+            pass
+
+
+def purge_staging(save_directory, max_age_seconds=24 * 60 * 60):
+    """放置された古い一時ファイルを削除し、削除した数を返す"""
+    directory = staging_directory(save_directory)
+    if not os.path.isdir(directory):
+        return 0
+
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,162 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+# inotify で監視するイベント（作成・書き込み完了・移動・削除）
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+# フォルダ自体が無くなった・取りこぼしがあった場合は全体を走査し直す
+_RESCAN_MASK = _IN_Q_OVERFLOW | _IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_inotify():
+    """inotify が使えれば libc を返す（Linux 以外では None）"""
+    if not hasattr(os, "O_NONBLOCK"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirectoryWatcher:
+    """保存フォルダを監視し、変更のあったファイルだけインデックスに反映するスレッド
+
+    inotify が使える環境ではイベントを、使えない環境では一定間隔の走査を使う。
+    日付・ハッシュで分けたサブフォルダも監視し、ファイル名は保存フォルダからの相対パスで扱う。
+    変更を反映するたびに version が増えるので、画面側はそれを見て再描画する。
+    """
+
+    def __init__(self, index, poll_interval=2.0, settle_seconds=0.2):
+        self.index = index
+        self.save_directory = index.save_directory
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.version = 0
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="directory-watcher", daemon=True)
+        self._thread.start()
+
+    def _publish(self, names):
+        """反映したファイルがあればバージョンを進める"""
+        if names:
+            self.version += 1
+
+    def _run(self):
+        libc = _load_inotify()
+        while not self._stop.is_set():
+            try:
+                self._publish(self.index.reconcile())
+            except Exception:
+                pass
+            # 最初の走査が終われば、インデックスから一覧を返せる
+            self._ready.set()
+            try:
+                if libc is not None and self._watch_inotify(libc):
+                    continue
+            except Exception:
+                pass
+            # inotify が使えない（上限に達した・フォルダが無い等）場合は走査で代用
+            self._stop.wait(self.poll_interval)
+
+    def _watch_inotify(self, libc):
+        """inotify でフォルダを監視する。走査し直しが必要になったら True を返す"""
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return False
+        try:
+            watches = self._add_watches(libc, fd)
+            if not watches:
+                # フォルダがまだ無い（削除された）場合は、作成されるまで走査で待つ
+                return False
+            # 監視を始める前の変更を取りこぼさないよう、もう一度だけ走査する
+            self._publish(self.index.reconcile())
+
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    # 開いたままのファイルがあると、フォルダを削除しても IN_DELETE_SELF が届かないことがある
+                    if not os.path.isdir(self.save_directory):
+                        return True
+                    continue
+                # まとめて保存された時に1枚ずつ反映しないよう、少し待ってから読む
+                time.sleep(self.settle_seconds)
+                names, rescan = self._read_events(fd, watches)
+                if rescan or not os.path.isdir(self.save_directory):
+                    return True
+                self._publish(self.index.refresh(names))
+            return False
+        finally:
+            os.close(fd)
+
+    def _add_watches(self, libc, fd):
+        """保存フォルダと隠しフォルダ以外のサブフォルダを監視し、監視番号から相対パスへの対応を返す
+
+        監視数の上限に達した場合は None を、保存フォルダが無い場合は空の辞書を返す。
+        """
+        watches = {}
+        for root, dirnames, _ in os.walk(self.save_directory):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            wd = libc.inotify_add_watch(fd, os.fsencode(root), _WATCH_MASK)
+            if wd < 0:
+                # 監視数の上限に達した場合などは走査で代用する
+                return None
+            relative = os.path.relpath(root, self.save_directory)
+            watches[wd] = "" if relative == "." else relative.replace(os.sep, "/")
+        return watches
+
+    def _read_events(self, fd, watches):
+        """溜まっているイベントを全て読み、ファイル名（相対パス）と走査し直しの要否を返す"""
+        names = set()
+        rescan = False
+        while True:
+            try:
+                buffer = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & _RESCAN_MASK or wd not in watches:
+                    rescan = True
+                elif mask & _IN_ISDIR:
+                    # サブフォルダの作成・移動は、監視を追加し直してフォルダごと走査する
+                    if not name.startswith(b"."):
+                        rescan = True
+                elif name:
+                    directory = watches[wd]
+                    name = os.fsdecode(name)
+                    names.add(f"{directory}/{name}" if directory else name)
+        return names, rescan
+
+    def wait_ready(self, timeout=None):
+        """最初の走査が終わるまで待つ"""
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
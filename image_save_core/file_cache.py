@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from . import metrics
+
+# キャッシュの利用状況
+FileCacheStats = namedtuple("FileCacheStats", ["hits", "misses", "evictions", "entries", "memory_bytes"])
+
+
+class FileCache:
+    """画像ファイルの中身をプロセス全体で共有するキャッシュ（LRU）
+
+    パスごとに更新時刻とサイズを覚えておき、変わっていれば読み直す。
+    大きさに関わらず1つの bytes を全セッションで共有し、合計が memory_limit_bytes を
+    超えたら古い順に破棄する。上限より大きいファイルはキャッシュせずにそのまま返す。
+    """
+
+    def __init__(self, memory_limit_bytes=256 * 1024 * 1024):
+        self.memory_limit_bytes = memory_limit_bytes
+
+        # 絶対パス -> (mtime_ns, size, bytes)
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, filepath):
+        """ファイルの中身(bytes)を取得。キャッシュに無いか古ければ読み込む"""
+        key = os.path.abspath(filepath)
+        stat = os.stat(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                metrics.count("file_cache_hits")
+                return entry[2]
+            self._misses += 1
+        metrics.count("file_cache_misses")
+
+        data = self._load(key)
+        if len(data) > self.memory_limit_bytes:
+            return data
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (stat.st_mtime_ns, stat.st_size, data)
+            self._memory_bytes += len(data)
+            self._evict()
+        return data
+
+    @metrics.timed("file_read")
+    def _load(self, filepath):
+        """ファイルを読み込む"""
+        with open(filepath, "rb") as f:
+            return f.read()
+
+    def _discard(self, key):
+        """1件をキャッシュから外す（ロックを取った状態で呼ぶ）"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[2])
+
+    def _evict(self):
+        """上限を超えた分を古い順に破棄（ロックを取った状態で呼ぶ）"""
+        while self._entries and self._memory_bytes > self.memory_limit_bytes:
+            key = next(iter(self._entries))
+            self._discard(key)
+            self._evictions += 1
+
+    def invalidate(self, filepath):
+        """削除・上書きしたファイルをキャッシュから外す"""
+        with self._lock:
+            self._discard(os.path.abspath(filepath))
+
+    def invalidate_many(self, filepaths):
+        """まとめて削除したファイルをキャッシュから外す"""
+        with self._lock:
+            for filepath in filepaths:
+                self._discard(os.path.abspath(filepath))
+
+    def stats(self):
+        """ヒット・ミス回数と使用量を取得"""
+        with self._lock:
+            return FileCacheStats(self._hits, self._misses, self._evictions, len(self._entries), self._memory_bytes)
+
+    def clear(self):
+        """キャッシュを全て破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
@@ -0,0 +1,622 @@
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from . import metrics
+from .image_probe import probe_image
+from .trash import DEFAULT_RETENTION_SECONDS
+
+# 保存フォルダ内に作るインデックスファイル
+INDEX_FILE_NAME = ".image_index.sqlite3"
+
+# 対応する画像形式（小文字で比較）
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+# スキーマを変更したら上げる（古いインデックスは作り直す）
+SCHEMA_VERSION = 5
+
+
+class ImageRecord(namedtuple(
+    "ImageRecord",
+    ["path", "name", "size", "mtime", "width", "height", "format", "orientation", "source"],
+)):
+    """インデックスに登録された画像1枚分のメタデータ"""
+
+    __slots__ = ()
+
+    @property
+    def display_size(self):
+        """EXIFの向きを反映した表示上の幅と高さ"""
+        if self.orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name        TEXT PRIMARY KEY,
+    dir         TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    width       INTEGER,
+    height      INTEGER,
+    format      TEXT,
+    orientation INTEGER,
+    source      TEXT,
+    content_hash TEXT,
+    phash       INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_mtime ON images (mtime_ns DESC, name DESC);
+CREATE INDEX IF NOT EXISTS images_hash ON images (content_hash);
+CREATE INDEX IF NOT EXISTS images_dir ON images (dir);
+CREATE INDEX IF NOT EXISTS images_unhashed_size ON images (size) WHERE content_hash IS NULL;
+CREATE TABLE IF NOT EXISTS dirs (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trashed (
+    name         TEXT PRIMARY KEY,
+    source       TEXT,
+    content_hash TEXT,
+    phash        INTEGER,
+    trashed_at   INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# 大きさと更新時刻が変わっていなければ、ハッシュ無しで登録し直しても既存のハッシュを残す
+# （移動したファイルをフォルダ監視が先に登録し直しても、移動元から引き継いだハッシュが消えない）
+_UPSERT = (
+    "INSERT INTO images "
+    "(name, dir, size, mtime_ns, width, height, format, orientation, source, content_hash, phash) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET "
+    "dir = excluded.dir, width = excluded.width, height = excluded.height, format = excluded.format, "
+    "orientation = excluded.orientation, source = excluded.source, "
+    "content_hash = CASE WHEN images.size = excluded.size AND images.mtime_ns = excluded.mtime_ns "
+    "THEN coalesce(excluded.content_hash, images.content_hash) ELSE excluded.content_hash END, "
+    "phash = CASE WHEN images.size = excluded.size AND images.mtime_ns = excluded.mtime_ns "
+    "THEN coalesce(excluded.phash, images.phash) ELSE excluded.phash END, "
+    "size = excluded.size, mtime_ns = excluded.mtime_ns"
+)
+
+
+def _to_signed(value):
+    """64ビットの知覚ハッシュを SQLite の INTEGER（符号付き）に収まる値に変換"""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def is_image_filename(filename):
+    """対応する画像ファイル名かどうかを判定"""
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def guess_source(filename):
+    """ファイル名から保存元（カメラ/アップロード）を推定"""
+    filename = posixpath.basename(filename)
+    if filename.startswith("camera_image_"):
+        return "camera"
+    if filename.startswith("upload_image_"):
+        return "upload"
+    return "external"
+
+
+def read_image_header(filepath):
+    """画像のヘッダーから解像度・形式・向きを取得（画素はデコードしない）"""
+    try:
+        return tuple(probe_image(filepath))
+    except Exception:
+        return None, None, None, 1
+
+
+class ImageIndex:
+    """保存フォルダ内の画像メタデータを保持する SQLite インデックス
+
+    画像は保存フォルダからの相対パス（"/" 区切り）で登録するため、
+    直下に保存する形式と日付・ハッシュのサブフォルダに分ける形式のどちらも扱える。
+    """
+
+    def __init__(self, save_directory="saved_images"):
+        self.save_directory = save_directory
+        self.db_path = os.path.join(save_directory, INDEX_FILE_NAME)
+        self._conn = None
+        self._lock = threading.Lock()
+        # 最後に保存フォルダ全体を走査し始めた時刻（time.monotonic()）
+        self._scanned_at = None
+
+    def _connection(self):
+        """接続を取得（初回のみスキーマを作成）"""
+        if self._conn is None:
+            os.makedirs(self.save_directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 4:
+                # 知覚ハッシュの列を足すだけなので、登録済みの内容は残す
+                conn.execute("ALTER TABLE images ADD COLUMN phash INTEGER")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            elif version != SCHEMA_VERSION:
+                # 古い形式のインデックスは破棄して次回の走査で作り直す
+                conn.executescript(
+                    "DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS meta;"
+                )
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def name_for(self, filepath):
+        """ファイルパスからインデックス上の名前（保存フォルダからの相対パス）を作成"""
+        return os.path.relpath(filepath, self.save_directory).replace(os.sep, "/")
+
+    def path_for(self, name):
+        """インデックス上の名前からファイルパスを作成"""
+        return os.path.join(self.save_directory, name)
+
+    def _row_for(self, name, stat, source, content_hash=None, perceptual_hash=None):
+        """ファイル情報からインデックスの行を作成"""
+        width, height, image_format, orientation = read_image_header(self.path_for(name))
+        return (
+            name, posixpath.dirname(name), stat.st_size, stat.st_mtime_ns,
+            width, height, image_format, orientation, source, content_hash, _to_signed(perceptual_hash),
+        )
+
+    def add(self, filepath, source=None, content_hash=None):
+        """保存したファイルをインデックスに登録"""
+        self.add_many([filepath], source, [content_hash])
+
+    @metrics.timed("index_add")
+    def add_many(self, filepaths, source=None, content_hashes=None, perceptual_hashes=None):
+        """まとめて保存したファイルを1回のトランザクションで登録"""
+        if content_hashes is None:
+            content_hashes = [None] * len(filepaths)
+        if perceptual_hashes is None:
+            perceptual_hashes = [None] * len(filepaths)
+        rows = []
+        for filepath, content_hash, perceptual_hash in zip(filepaths, content_hashes, perceptual_hashes):
+            name = self.name_for(filepath)
+            rows.append(self._row_for(
+                name, os.stat(filepath), source or guess_source(name), content_hash, perceptual_hash,
+            ))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(_UPSERT, rows)
+
+    def remove(self, filepath):
+        """削除したファイルをインデックスから除外"""
+        self.remove_many([filepath])
+
+    def kept_info(self, filepaths):
+        """移動・削除の前に、名前から (保存元, 内容のハッシュ, 知覚ハッシュ) への対応を取得
+
+        フォルダ監視は移動を削除と追加として反映するため、移動後には読めないことがある。
+        """
+        names = [self.name_for(filepath) for filepath in filepaths]
+        info = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = conn.execute(
+                    "SELECT name, source, content_hash, phash FROM images "
+                    f"WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                info.update((name, tuple(row)) for name, *row in rows)
+        return info
+
+    def remove_many(self, filepaths, trashed_paths=None, trash_info=None):
+        """まとめて削除したファイルを1回のトランザクションで除外
+
+        trashed_paths（ゴミ箱に移動した先のパス）と、移動する前に kept_info で
+        取得した内容を渡すと、元に戻す時のためにゴミ箱内のパスで残しておく。
+        """
+        names = [self.name_for(filepath) for filepath in filepaths]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if trashed_paths is not None:
+                    now = int(time.time())
+                    # ゴミ箱から完全に削除された頃の古い記録は捨てる
+                    conn.execute("DELETE FROM trashed WHERE trashed_at < ?", (now - DEFAULT_RETENTION_SECONDS,))
+                    conn.executemany("INSERT OR REPLACE INTO trashed VALUES (?, ?, ?, ?, ?)", [
+                        (self.name_for(trashed), *(trash_info or {})[name], now)
+                        for name, trashed in zip(names, trashed_paths) if name in (trash_info or {})
+                    ])
+                conn.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in names])
+
+    def restore_many(self, moves):
+        """ゴミ箱から戻したファイル（(元のパス, ゴミ箱内のパス) のリスト）を、削除前の保存元とハッシュで登録"""
+        trashed_names = [self.name_for(trashed) for _, trashed in moves]
+        kept = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(trashed_names), 500):
+                chunk = trashed_names[start:start + 500]
+                rows = conn.execute(
+                    "SELECT name, source, content_hash, phash FROM trashed "
+                    f"WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                kept.update((name, row) for name, *row in rows)
+
+        rows = []
+        for (original, _), trashed_name in zip(moves, trashed_names):
+            name = self.name_for(original)
+            source, content_hash, perceptual_hash = kept.get(trashed_name, (None, None, None))
+            rows.append(self._row_for(
+                name, os.stat(original), source or guess_source(name), content_hash,
+                _to_unsigned(perceptual_hash) if perceptual_hash is not None else None,
+            ))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(_UPSERT, rows)
+                conn.executemany("DELETE FROM trashed WHERE name = ?", [(name,) for name in trashed_names])
+
+    def rename_many(self, moves, kept_info=None):
+        """移動したファイル（(元のパス, 新しいパス) のリスト）を新しいパスで登録し直す
+
+        移動する前に kept_info で取得した内容を渡すと、保存元とハッシュを引き継ぐ
+        （フォルダ監視が先に移動元を除外していても失われない）。
+        """
+        rows = []
+        for src, dest in moves:
+            name = self.name_for(dest)
+            source, content_hash, perceptual_hash = (kept_info or {}).get(self.name_for(src), (None, None, None))
+            try:
+                stat = os.stat(dest)
+            except FileNotFoundError:
+                continue
+            rows.append(self._row_for(
+                name, stat, source or guess_source(name), content_hash,
+                _to_unsigned(perceptual_hash) if perceptual_hash is not None else None,
+            ))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM images WHERE name = ?", [(self.name_for(src),) for src, _ in moves])
+                conn.executemany(_UPSERT, rows)
+
+    def find_by_hash(self, content_hash):
+        """同じ内容（SHA-256）の保存済み画像のパスを取得。無ければ None"""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT name FROM images WHERE content_hash = ? LIMIT 1", (content_hash,)
+            ).fetchone()
+        return self.path_for(row[0]) if row else None
+
+    def unhashed_with_size(self, size):
+        """内容のハッシュがまだ無い、指定したバイト数の画像のパスのリスト"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT name FROM images WHERE content_hash IS NULL AND size = ?", (size,)
+            ).fetchall()
+        return [self.path_for(name) for name, in rows]
+
+    def set_content_hashes(self, pairs):
+        """(ファイルパス, SHA-256) のリストをまとめて登録"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE images SET content_hash = ? WHERE name = ?",
+                    [(content_hash, self.name_for(filepath)) for filepath, content_hash in pairs],
+                )
+
+    def missing_content_hashes(self):
+        """内容のハッシュがまだ無い画像のパスのリスト"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT name FROM images WHERE content_hash IS NULL ORDER BY name").fetchall()
+        return [self.path_for(name) for name, in rows]
+
+    def count_missing_content_hashes(self):
+        """内容のハッシュがまだ無い画像の枚数"""
+        with self._lock:
+            conn = self._connection()
+            return conn.execute("SELECT COUNT(*) FROM images WHERE content_hash IS NULL").fetchone()[0]
+
+    def set_perceptual_hashes(self, pairs):
+        """(ファイルパス, 知覚ハッシュ) のリストをまとめて登録"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE images SET phash = ? WHERE name = ?",
+                    [(_to_signed(value), self.name_for(filepath)) for filepath, value in pairs],
+                )
+
+    def perceptual_hashes(self):
+        """知覚ハッシュのある画像の (名前, ハッシュ) のリスト"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT name, phash FROM images WHERE phash IS NOT NULL").fetchall()
+        return [(name, _to_unsigned(value)) for name, value in rows]
+
+    def missing_perceptual_hashes(self):
+        """知覚ハッシュがまだ無い画像のパスのリスト"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT name FROM images WHERE phash IS NULL ORDER BY name").fetchall()
+        return [self.path_for(name) for name, in rows]
+
+    def count_missing_perceptual_hashes(self):
+        """知覚ハッシュがまだ無い画像の枚数"""
+        with self._lock:
+            conn = self._connection()
+            return conn.execute("SELECT COUNT(*) FROM images WHERE phash IS NULL").fetchone()[0]
+
+    def change_token(self):
+        """インデックスが変わったかを調べるための値（この接続と他の接続での変更を反映）"""
+        with self._lock:
+            conn = self._connection()
+            return conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes
+
+    def record_duplicate(self, size):
+        """重複として保存を省いた画像の枚数と容量を加算"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for key, amount in (("dedup_files", 1), ("dedup_bytes", size)):
+                    conn.execute(
+                        "INSERT INTO meta VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                        (key, amount),
+                    )
+
+    def duplicate_stats(self):
+        """重複の省略で節約した枚数とバイト数"""
+        with self._lock:
+            conn = self._connection()
+            stats = dict(conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('dedup_files', 'dedup_bytes')"
+            ).fetchall())
+        return stats.get("dedup_files", 0), stats.get("dedup_bytes", 0)
+
+    @metrics.timed("index_reconcile")
+    def reconcile(self, force=False, subdirectories=None, max_age=None):
+        """フォルダを走査し、変更のあったファイルだけインデックスを更新
+
+        フォルダごとに更新時刻を覚えておき、エントリに増減の無いフォルダは
+        読まずに済ませる。subdirectories（相対パスのリスト）を渡すと、
+        そのフォルダ以下だけを確認する。max_age（秒）を渡すと、その時間内に
+        全体を走査していれば走査を省く（ハッシュで分けたフォルダは数万になり、
+        更新時刻の確認だけでも時間がかかるため）。追加・変更・削除されたファイル名のリストを返す。
+        """
+        if not os.path.isdir(self.save_directory):
+            return []
+        if (not force and max_age is not None and self._scanned_at is not None
+                and time.monotonic() - self._scanned_at < max_age):
+            return []
+        started = time.monotonic()
+
+        with self._lock:
+            if self._conn is not None and not os.path.exists(self.db_path):
+                # 保存フォルダごと削除されて作り直された場合は、新しいフォルダにインデックスを作り直す
+                self._conn.close()
+                self._conn = None
+            # インデックスファイル自体の作成でフォルダの更新時刻が変わるため先に接続する
+            conn = self._connection()
+            known_dirs = dict(conn.execute("SELECT path, mtime_ns FROM dirs"))
+
+        children = {}
+        for path in known_dirs:
+            if path:
+                children.setdefault(posixpath.dirname(path), []).append(path)
+
+        changed = []
+        removed = []
+        removed_dirs = []
+        dir_mtimes = []
+        pending = list(subdirectories) if subdirectories is not None else [""]
+        while pending:
+            relative = pending.pop()
+            directory = os.path.join(self.save_directory, relative) if relative else self.save_directory
+            try:
+                dir_mtime_ns = os.stat(directory).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                if relative in known_dirs:
+                    removed_dirs.append(relative)
+                continue
+            if not force and known_dirs.get(relative) == dir_mtime_ns:
+                # エントリに増減が無ければ、覚えているサブフォルダだけを確認する
+                pending.extend(children.get(relative, ()))
+                continue
+
+            with self._lock:
+                known = {
+                    name: (size, mtime_ns, source)
+                    for name, size, mtime_ns, source in self._conn.execute(
+                        "SELECT name, size, mtime_ns, source FROM images WHERE dir = ?", (relative,)
+                    )
+                }
+            seen = set()
+            subdirectories_seen = set()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    name = posixpath.join(relative, entry.name) if relative else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories_seen.add(name)
+                        pending.append(name)
+                        continue
+                    if not is_image_filename(entry.name) or not entry.is_file():
+                        continue
+                    seen.add(name)
+                    stat = entry.stat()
+                    previous = known.get(name)
+                    if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    source = previous[2] if previous is not None else guess_source(name)
+                    changed.append(self._row_for(name, stat, source))
+
+            removed.extend(known.keys() - seen)
+            removed_dirs.extend(set(children.get(relative, ())) - subdirectories_seen)
+            dir_mtimes.append((relative, dir_mtime_ns))
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if changed:
+                    conn.executemany(_UPSERT, changed)
+                if removed:
+                    conn.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in removed])
+                for relative in removed_dirs:
+                    # 無くなったフォルダの中の画像とサブフォルダもまとめて除外
+                    prefix = relative.replace("%", r"\%").replace("_", r"\_") + "/%"
+                    cursor = conn.execute(
+                        "DELETE FROM images WHERE dir = ? OR dir LIKE ? ESCAPE '\\' RETURNING name",
+                        (relative, prefix),
+                    )
+                    removed.extend(name for name, in cursor)
+                    conn.execute(
+                        "DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (relative, prefix)
+                    )
+                if dir_mtimes:
+                    conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?)", dir_mtimes)
+        if subdirectories is None:
+            self._scanned_at = started
+        return [row[0] for row in changed] + removed
+
+    @metrics.timed("index_refresh")
+    def refresh(self, names):
+        """指定したファイルだけを確認してインデックスを更新（フォルダ監視から呼ばれる）
+
+        変更の無いファイルは読み直さず、保存元と内容ハッシュもそのまま残す。
+        実際に更新したファイル名のリストを返す。
+        """
+        names = [name for name in set(names) if is_image_filename(name)]
+        directories = {posixpath.dirname(name) for name in names}
+        with self._lock:
+            conn = self._connection()
+            # 反映後の状態を走査済みとして記録するため、確認の前に時刻を取る
+            dir_mtimes = []
+            for relative in directories:
+                try:
+                    dir_mtimes.append(
+                        (relative, os.stat(os.path.join(self.save_directory, relative)).st_mtime_ns)
+                    )
+                except FileNotFoundError:
+                    pass
+            known = {}
+            for name in names:
+                row = conn.execute(
+                    "SELECT size, mtime_ns, source FROM images WHERE name = ?", (name,)
+                ).fetchone()
+                if row is not None:
+                    known[name] = row
+
+        changed = []
+        removed = []
+        for name in names:
+            previous = known.get(name)
+            try:
+                stat = os.stat(os.path.join(self.save_directory, name))
+            except FileNotFoundError:
+                if previous is not None:
+                    removed.append((name,))
+                continue
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            source = previous[2] if previous is not None else guess_source(name)
+            changed.append(self._row_for(name, stat, source))
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if changed:
+                    conn.executemany(_UPSERT, changed)
+                if removed:
+                    conn.executemany("DELETE FROM images WHERE name = ?", removed)
+                # 新しいフォルダは reconcile でサブフォルダと一緒に登録するため、既知のフォルダだけ更新する
+                conn.executemany("UPDATE dirs SET mtime_ns = ? WHERE path = ?", [
+                    (mtime_ns, relative) for relative, mtime_ns in dir_mtimes
+                ])
+        return [row[0] for row in changed] + [name for name, in removed]
+
+    def _time_filter(self, start_time, end_time):
+        """期間指定（UNIX時刻、end_time は含まない）からWHERE句を作成"""
+        clauses = []
+        params = []
+        if start_time is not None:
+            clauses.append("mtime_ns >= ?")
+            params.append(int(start_time * 1e9))
+        if end_time is not None:
+            clauses.append("mtime_ns < ?")
+            params.append(int(end_time * 1e9))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def count_records(self, start_time=None, end_time=None):
+        """期間内の画像の枚数を取得"""
+        where, params = self._time_filter(start_time, end_time)
+        with self._lock:
+            conn = self._connection()
+            return conn.execute(f"SELECT COUNT(*) FROM images{where}", params).fetchone()[0]
+
+    def total_size(self, start_time=None, end_time=None):
+        """期間内の画像の合計バイト数を取得"""
+        where, params = self._time_filter(start_time, end_time)
+        with self._lock:
+            conn = self._connection()
+            return conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM images{where}", params).fetchone()[0]
+
+    def sizes(self, filepaths):
+        """登録されている画像のパスからバイト数への対応（登録の無いパスは含まない）"""
+        names = {self.name_for(filepath): filepath for filepath in filepaths}
+        items = list(names)
+        sizes = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(items), 500):
+                chunk = items[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT name, size FROM images WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                sizes.update((names[name], size) for name, size in rows)
+        return sizes
+
+    @metrics.timed("index_query")
+    def list_records(self, start_time=None, end_time=None, limit=None, offset=0):
+        """インデックスに登録された画像を新しい順に取得（期間・件数で絞り込み可能）"""
+        where, params = self._time_filter(start_time, end_time)
+        query = (
+            "SELECT name, size, mtime_ns, width, height, format, orientation, source "
+            f"FROM images{where} ORDER BY mtime_ns DESC, name DESC"
+        )
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(query, params).fetchall()
+        return [
+            ImageRecord(
+                os.path.join(self.save_directory, name), name, size, mtime_ns / 1e9,
+                width, height, image_format, orientation, source,
+            )
+            for name, size, mtime_ns, width, height, image_format, orientation, source in rows
+        ]
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,153 @@
+import os
+import struct
+from collections import namedtuple
+
+from . import metrics
+
+
+class ImageInfo(namedtuple("ImageInfo", ["width", "height", "format", "orientation"])):
+    """ヘッダーから読み取った画像の基本情報"""
+
+    __slots__ = ()
+
+    @property
+    def display_size(self):
+        """EXIFの向き（5〜8は90度回転）を反映した表示上の幅と高さ"""
+        if self.orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+
+# JPEG の SOF マーカー（DHT/JPG/DAC の C4, C8, CC を除く）
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# 長さフィールドを持たない JPEG マーカー
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _read_exact(f, size):
+    """指定バイト数を読み込み、足りなければ ValueError"""
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("ファイルが途中で終わっています")
+    return data
+
+
+def _exif_orientation(exif):
+    """APP1 (Exif) セグメントから Orientation タグを取得"""
+    if len(exif) < 14 or not exif.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = exif[6:]
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1
+
+    ifd_offset = struct.unpack(f"{endian}I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    entry_count = struct.unpack(f"{endian}H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for n in range(entry_count):
+        entry = ifd_offset + 2 + n * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, value_type = struct.unpack(f"{endian}HH", tiff[entry:entry + 4])
+        if tag == _EXIF_ORIENTATION_TAG and value_type == 3:  # SHORT
+            orientation = struct.unpack(f"{endian}H", tiff[entry + 8:entry + 10])[0]
+            return orientation if 1 <= orientation <= 8 else 1
+    return 1
+
+
+def _probe_jpeg(f):
+    """JPEG のマーカーを順に読み、SOF から解像度を取得"""
+    orientation = 1
+    while True:
+        byte = _read_exact(f, 1)
+        if byte != b"\xff":
+            raise ValueError("JPEG マーカーが見つかりません")
+        marker = _read_exact(f, 1)[0]
+        # マーカー前の 0xFF の詰め物を読み飛ばす
+        while marker == 0xFF:
+            marker = _read_exact(f, 1)[0]
+
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):  # EOI / SOS まで SOF が無い
+            raise ValueError("JPEG の SOF が見つかりません")
+
+        length = struct.unpack(">H", _read_exact(f, 2))[0]
+        if length < 2:
+            raise ValueError("JPEG セグメント長が不正です")
+
+        if marker in _JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", _read_exact(f, 5))
+            return ImageInfo(width, height, "JPEG", orientation)
+        if marker == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(_read_exact(f, length - 2))
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_header(f):
+    """先頭のシグネチャから形式を判別してヘッダーを解析"""
+    head = f.read(26)
+    if head[:2] == b"\xff\xd8":
+        f.seek(-len(head) + 2, os.SEEK_CUR)
+        return _probe_jpeg(f)
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", head[16:24])
+        return ImageInfo(width, height, "PNG", 1)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", head[6:10])
+        return ImageInfo(width, height, "GIF", 1)
+    if head[:2] == b"BM" and len(head) >= 26:
+        dib_size = struct.unpack("<I", head[14:18])[0]
+        if dib_size == 12:  # OS/2 BITMAPCOREHEADER
+            width, height = struct.unpack("<HH", head[18:22])
+        else:
+            width, height = struct.unpack("<ii", head[18:26])
+        # 高さが負の値はトップダウン形式
+        return ImageInfo(width, abs(height), "BMP", 1)
+    raise ValueError("未対応の画像形式です")
+
+
+def _probe_with_pillow(f):
+    """Pillow でヘッダーを読み込む（画素はデコードしない）"""
+    # Pillow は読み込みに時間がかかるため、ヘッダーを解析できない時だけ読み込む
+    from PIL import Image
+
+    with Image.open(f) as image:
+        orientation = image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+        return ImageInfo(image.size[0], image.size[1], image.format, orientation)
+
+
+def _probe_file(f):
+    """ファイルオブジェクトの現在位置から情報を取得"""
+    start = f.tell()
+    try:
+        return _probe_header(f)
+    except (ValueError, struct.error):
+        f.seek(start)
+        return _probe_with_pillow(f)
+
+
+@metrics.timed("probe_image")
+def probe_image(source):
+    """画像の幅・高さ・形式・EXIFの向きをヘッダーだけから取得
+
+    source にはファイルパス、またはシーク可能なバイナリのファイルオブジェクト
+    （st.file_uploader の UploadedFile など）を渡す。ファイルオブジェクトの
+    読み込み位置は元に戻す。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _probe_file(f)
+
+    position = source.tell()
+    try:
+        return _probe_file(source)
+    finally:
+        source.seek(position)
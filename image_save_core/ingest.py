@@ -0,0 +1,144 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from . import metrics
+
+# 保存前の変換設定
+#   max_edge: 長辺の最大ピクセル数（None なら縮小しない）
+#   format: 変換後の形式（None なら元の形式のまま）
+#   quality: JPEG/WebP の品質
+#   keep_exif: EXIF を残すかどうか（向きは画素に反映してから 1 に戻す）
+IngestProfile = namedtuple("IngestProfile", ["label", "max_edge", "format", "quality", "keep_exif"])
+
+INGEST_PROFILES = {
+    "original": IngestProfile("そのまま保存", None, None, None, True),
+    "jpeg_high": IngestProfile("JPEG 高画質（長辺 3840px・品質 92）", 3840, "JPEG", 92, True),
+    "jpeg_standard": IngestProfile("JPEG 標準（長辺 2048px・品質 85・EXIF 削除）", 2048, "JPEG", 85, False),
+    "webp_compact": IngestProfile("WebP 軽量（長辺 1600px・品質 80・EXIF 削除）", 1600, "WEBP", 80, False),
+}
+
+_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "BMP": ".bmp", "WEBP": ".webp"}
+
+# アニメーションの可能性があるため変換しない形式
+_PASSTHROUGH_FORMATS = ("GIF",)
+
+
+def is_passthrough(profile):
+    """何も変換しないプロファイルかどうか"""
+    return profile.max_edge is None and profile.format is None and profile.keep_exif
+
+
+def output_format(source_format, profile):
+    """元の形式とプロファイルから保存する形式を決める"""
+    if source_format in _PASSTHROUGH_FORMATS or is_passthrough(profile):
+        return source_format
+    return profile.format or source_format
+
+
+def output_filename(filename, source_format, profile):
+    """変換後の形式に合わせて拡張子を付け替えたファイル名"""
+    target = output_format(source_format, profile)
+    if target == source_format or target not in _EXTENSIONS:
+        return filename
+    return os.path.splitext(filename)[0] + _EXTENSIONS[target]
+
+
+def transcode(data, profile):
+    """画像を縮小・形式変換してバイト列を返す（プロセスプール内で実行される）"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        target = output_format(source_format, profile)
+        if source_format in _PASSTHROUGH_FORMATS or is_passthrough(profile):
+            return data
+
+        if profile.max_edge is not None:
+            # JPEG はデコード時点で縮小させる
+            image.draft("RGB", (profile.max_edge, profile.max_edge))
+        exif = image.getexif()
+        # 元のバイト列をそのまま返すと残ってしまうメタデータ
+        has_metadata = bool(exif) or any(key in image.info for key in ("exif", "xmp", "XML:com.adobe.xmp"))
+        icc_profile = image.info.get("icc_profile")
+        image = ImageOps.exif_transpose(image)
+
+        resized = False
+        if profile.max_edge is not None and max(image.size) > profile.max_edge:
+            image.thumbnail((profile.max_edge, profile.max_edge), Image.LANCZOS)
+            resized = True
+
+        if target == "JPEG" and image.mode not in ("RGB", "L"):
+            # 透過部分は白で塗りつぶす
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+
+        elif target == "WEBP" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("P", "LA", "PA") else "RGB")
+
+        options = {}
+        if profile.quality is not None and target in ("JPEG", "WEBP"):
+            options["quality"] = profile.quality
+        if target == "JPEG":
+            options["optimize"] = True
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        if profile.keep_exif and exif:
+            exif[0x0112] = 1  # 向きは画素に反映済み
+            options["exif"] = exif.tobytes()
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=target, **options)
+
+    result = buffer.getvalue()
+    # 縮小も形式変換もしていないのに大きくなった場合は元のまま（EXIF を削除するプロファイルで、元にメタデータがある場合を除く）
+    if (not resized and target == source_format and len(result) >= len(data)
+            and (profile.keep_exif or not has_metadata)):
+        return data
+    return result
+
+
+class IngestProcessor:
+    """保存前の画像変換をプロセスプールで並列に行うクラス"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Streamlit はスレッドを使うため fork ではなく spawn で起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    @metrics.timed("ingest_transcode")
+    def transcode(self, data, profile):
+        """1枚を変換（呼び出したスレッドは結果が出るまで待つ）"""
+        if is_passthrough(profile):
+            return data
+        return self._pool().submit(transcode, bytes(data), profile).result()
+
+    def transcode_many(self, buffers, profile):
+        """複数枚をまとめて並列に変換"""
+        if is_passthrough(profile):
+            return list(buffers)
+        return list(self._pool().map(transcode, [bytes(b) for b in buffers], [profile] * len(buffers)))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,82 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+# 保存先フォルダの分け方
+#   flat: 保存フォルダの直下に保存
+#   date: 保存日ごとに YYYY/MM/DD/ に分けて保存
+#   hash: ファイル名のハッシュの先頭4文字で ab/cd/ に分けて保存（1フォルダあたり数件に分散）
+LAYOUTS = ("flat", "date", "hash")
+
+# 保存フォルダ内に置く、分け方の設定ファイル
+LAYOUT_FILE_NAME = ".layout"
+
+# 保存フォルダの目印になるファイル（上の階層をたどって保存フォルダを探す時に使う）
+_ROOT_MARKERS = (LAYOUT_FILE_NAME, ".image_index.sqlite3")
+
+
+def read_layout(save_directory):
+    """保存フォルダの分け方を取得（設定が無ければ flat）"""
+    try:
+        with open(os.path.join(save_directory, LAYOUT_FILE_NAME)) as f:
+            layout = f.read().strip()
+    except FileNotFoundError:
+        return "flat"
+    return layout if layout in LAYOUTS else "flat"
+
+
+def write_layout(save_directory, layout):
+    """以降の保存で使う分け方を設定（既存の画像はそのまま。移動は migrate で行う）"""
+    if layout not in LAYOUTS:
+        raise ValueError(f"不明な保存レイアウトです: {layout}")
+    os.makedirs(save_directory, exist_ok=True)
+    tmp_path = os.path.join(save_directory, f"{LAYOUT_FILE_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(layout)
+    os.replace(tmp_path, os.path.join(save_directory, LAYOUT_FILE_NAME))
+
+
+def shard_directory(save_directory, layout, filename, when=None):
+    """分け方に従って、filename を保存するフォルダを返す
+
+    date は when（datetime、省略時は現在時刻）の日付、hash はファイル名から決める。
+    """
+    if layout == "date":
+        when = when or datetime.now()
+        return os.path.join(save_directory, f"{when:%Y}", f"{when:%m}", f"{when:%d}")
+    if layout == "hash":
+        digest = hashlib.sha1(os.path.basename(filename).encode("utf-8")).hexdigest()
+        return os.path.join(save_directory, digest[:2], digest[2:4])
+    return save_directory
+
+
+def date_shards(start_time=None, end_time=None):
+    """date レイアウトで期間（UNIX時刻、end_time は含まない）に含まれる日付フォルダの相対パス
+
+    開始の指定が無い場合は None（全てのフォルダが対象）、終了の指定が無い場合は今日まで。
+    """
+    if start_time is None:
+        return None
+    day = datetime.fromtimestamp(start_time).date()
+    last_day = datetime.fromtimestamp(end_time - 1e-6).date() if end_time is not None else datetime.now().date()
+    shards = []
+    while day <= last_day:
+        shards.append(f"{day:%Y}/{day:%m}/{day:%d}")
+        day += timedelta(days=1)
+    return shards
+
+
+def find_save_directory(filepath):
+    """画像のパスから、それを含む保存フォルダを探す（見つからなければ画像のあるフォルダ）"""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    candidate = directory
+    while True:
+        if any(os.path.exists(os.path.join(candidate, marker)) for marker in _ROOT_MARKERS):
+            # 呼び出し元のパスが相対パスなら、保存フォルダも相対パスで返す
+            if not os.path.isabs(filepath):
+                return os.path.relpath(candidate)
+            return candidate
+        parent = os.path.dirname(candidate)
+        if parent == candidate:
+            return os.path.dirname(filepath)
+        candidate = parent
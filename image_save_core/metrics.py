@@ -0,0 +1,195 @@
+import contextvars
+import functools
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+
+# 計測項目ごとの集計（呼び出し回数・合計時間・最大時間）
+TimerStats = namedtuple("TimerStats", ["calls", "seconds", "max_seconds"])
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "image_save"
+
+_enabled = False
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+
+# 計測中の再実行ごとの記録先（Streamlit はセッションごとにスレッドを分けて実行する）
+_current_recorder = contextvars.ContextVar("metrics_recorder", default=None)
+
+# 無効時に返す何もしないコンテキストマネージャ（毎回作らない）
+_NULL_TIMER = nullcontext()
+
+
+def set_enabled(enabled):
+    """計測の有効・無効を切り替える（プロセス全体）"""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+class Recorder:
+    """1回の処理（Streamlit の再実行1回分など）の計測結果"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timers = {}
+        self.counters = {}
+        self._token = None
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _add_time(self, name, seconds):
+        calls, total, longest = self.timers.get(name, (0, 0.0, 0.0))
+        self.timers[name] = TimerStats(calls + 1, total + seconds, max(longest, seconds))
+
+    def _add_count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+def start_recording():
+    """このスレッドで以降に計測した結果を集める Recorder を開始"""
+    recorder = Recorder()
+    recorder._token = _current_recorder.set(recorder)
+    return recorder
+
+
+def stop_recording(recorder):
+    """start_recording で開始した記録を終了"""
+    _current_recorder.reset(recorder._token)
+    return recorder
+
+
+def _record_time(name, seconds):
+    with _lock:
+        calls, total, longest = _timers.get(name, (0, 0.0, 0.0))
+        _timers[name] = TimerStats(calls + 1, total + seconds, max(longest, seconds))
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder._add_time(name, seconds)
+
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record_time(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def timer(name):
+    """with 文で囲んだ処理の時間を計測（無効時は何もしない）"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed(name):
+    """関数の実行時間を計測するデコレーター（無効時はそのまま呼び出す）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_time(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    """回数やバイト数を加算（無効時は何もしない）"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder._add_count(name, amount)
+
+
+def snapshot():
+    """プロセス全体の累計（計測項目, カウンタ）のコピーを取得"""
+    with _lock:
+        return dict(_timers), dict(_counters)
+
+
+def reset():
+    """累計をクリア"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _metric_name(name):
+    return f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def export_prometheus():
+    """累計を Prometheus のテキスト形式で出力"""
+    timers, counters = snapshot()
+    lines = []
+    for name, stats in sorted(timers.items()):
+        metric = _metric_name(name)
+        lines += [
+            f"# TYPE {metric}_seconds summary",
+            f"{metric}_seconds_count {stats.calls}",
+            f"{metric}_seconds_sum {stats.seconds:.6f}",
+            f"# TYPE {metric}_max_seconds gauge",
+            f"{metric}_max_seconds {stats.max_seconds:.6f}",
+        ]
+    for name, value in sorted(counters.items()):
+        metric = _metric_name(name)
+        lines += [f"# TYPE {metric}_total counter", f"{metric}_total {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(filepath):
+    """Prometheus 形式のファイルを書き出す（node_exporter の textfile collector 向け）"""
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(export_prometheus())
+    os.replace(tmp_path, filepath)
+
+
+def serve_prometheus(port, host="127.0.0.1"):
+    """/metrics を返す HTTP サーバーをバックグラウンドで起動"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
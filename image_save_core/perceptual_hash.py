@@ -0,0 +1,189 @@
+import io
+import threading
+
+from . import metrics
+
+# 画像を縮小する大きさと、DCT の低周波成分から使う範囲（8x8 = 64ビット）
+SAMPLE_SIZE = 32
+HASH_SIZE = 8
+
+# 似ている画像とみなすハッシュの距離（異なるビット数）の既定値
+DEFAULT_MAX_DISTANCE = 6
+
+_dct_matrix = None
+_popcount_table = None
+
+
+def _dct():
+    """SAMPLE_SIZE 点の DCT-II 行列（初回のみ作成）"""
+    global _dct_matrix
+    if _dct_matrix is None:
+        import numpy as np
+
+        k = np.arange(SAMPLE_SIZE)[:, None]
+        n = np.arange(SAMPLE_SIZE)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * SAMPLE_SIZE)) * np.sqrt(2 / SAMPLE_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+
+def load_grayscale(source):
+    """画像（パスかバイト列）を SAMPLE_SIZE 四方のグレースケール配列に縮小"""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+        # JPEG はデコード時点で縮小させる
+        image.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX)
+        return np.asarray(image, dtype=np.float32)
+
+
+def compute_hashes(arrays):
+    """グレースケール配列をまとめて DCT し、64ビットの知覚ハッシュ（pHash）のリストを返す"""
+    import numpy as np
+
+    if not len(arrays):
+        return []
+    dct = _dct()
+    coefficients = dct @ np.stack(arrays) @ dct.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(arrays), -1)
+    # 直流成分を除いた中央値より大きい成分を 1 にする
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return [int(value) for value in np.packbits(bits, axis=1).view(">u8").ravel()]
+
+
+def _popcount():
+    """0〜255 のそれぞれのビット数の表（初回のみ作成）"""
+    global _popcount_table
+    if _popcount_table is None:
+        import numpy as np
+
+        _popcount_table = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+    return _popcount_table
+
+
+def _try_load(source):
+    try:
+        return load_grayscale(source)
+    except Exception:
+        return None
+
+
+@metrics.timed("perceptual_hash")
+def hash_images(sources, executor=None):
+    """画像（パスかバイト列）の知覚ハッシュのリストを返す（読めない画像は None）
+
+    executor を渡すと、デコードと縮小をそのスレッドプールで並列に行う。
+    DCT は縮小した配列をまとめて1回で計算する。
+    """
+    arrays = list(executor.map(_try_load, sources)) if executor is not None else [_try_load(s) for s in sources]
+    loaded = [array for array in arrays if array is not None]
+    hashes = iter(compute_hashes(loaded))
+    return [next(hashes) if array is not None else None for array in arrays]
+
+
+def hamming_distance(a, b):
+    """2つのハッシュで異なるビットの数"""
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+    """ハミング距離で近いハッシュを探す索引（multi-index hashing）
+
+    64ビットを8ビットずつ8つの部分に分け、部分ごとに並べ替えた配列を持つ。
+    距離が7以下なら8つの部分のどれかは完全に一致するため、一致する部分を持つ
+    ハッシュだけを候補にして距離を比べれば、漏れなく全件と比べずに済む。
+    """
+
+    CHUNKS = 8
+
+    def __init__(self, values):
+        import numpy as np
+
+        self.values = np.asarray(values, dtype=np.uint64)
+        self._orders = []
+        self._keys = []
+        for chunk in range(self.CHUNKS):
+            keys = ((self.values >> np.uint64(chunk * 8)) & np.uint64(0xFF)).astype(np.uint8)
+            order = np.argsort(keys, kind="stable")
+            self._orders.append(order)
+            self._keys.append(keys[order])
+
+    def search(self, value, max_distance):
+        """value から max_distance 以内のハッシュの (位置の配列, 距離の配列) を近い順に返す"""
+        import numpy as np
+
+        if max_distance < self.CHUNKS:
+            candidates = []
+            for chunk, (order, keys) in enumerate(zip(self._orders, self._keys)):
+                key = (value >> (chunk * 8)) & 0xFF
+                start = np.searchsorted(keys, key, side="left")
+                end = np.searchsorted(keys, key, side="right")
+                candidates.append(order[start:end])
+            # 複数の部分で一致した候補は重複するが、距離を比べた後に1つにまとめる方が速い
+            candidates = np.concatenate(candidates)
+        else:
+            # 部分の一致が保証されない距離では全件と比べる（配列演算なので10万件でも数ミリ秒）
+            candidates = np.arange(len(self.values))
+        differences = self.values[candidates] ^ np.uint64(value)
+        if hasattr(np, "bitwise_count"):
+            distances = np.bitwise_count(differences)
+        else:
+            # numpy 2.0 より前は1バイトずつ表を引いて数える
+            distances = _popcount()[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        matched = distances <= max_distance
+        candidates, first = np.unique(candidates[matched], return_index=True)
+        distances = distances[matched][first]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class SimilarImageIndex:
+    """インデックスに登録された知覚ハッシュから、似ている画像を探す
+
+    インデックスに変更があった時だけ、登録済みのハッシュを読み直して索引を作り直す。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._names = []
+        self._positions = {}
+        self._search = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    @metrics.timed("similarity_refresh")
+    def refresh(self):
+        """インデックスに変更があれば索引を作り直す"""
+        token = self.index.change_token()
+        with self._lock:
+            if token == self._token:
+                return
+            pairs = self.index.perceptual_hashes()
+            self._names = [name for name, _ in pairs]
+            self._positions = {name: position for position, name in enumerate(self._names)}
+            self._search = MultiIndexHash([value for _, value in pairs])
+            self._token = token
+
+    def find_similar(self, filepath, max_distance=DEFAULT_MAX_DISTANCE, limit=None):
+        """filepath に似ている画像の (距離, パス) を近い順に返す（ハッシュが無ければ空）"""
+        self.refresh()
+        with self._lock:
+            position = self._positions.get(self.index.name_for(filepath))
+            if position is None:
+                return []
+            positions, distances = self._search.search(int(self._search.values[position]), max_distance)
+            results = [
+                (int(distance), self.index.path_for(self._names[other]))
+                for other, distance in zip(positions, distances) if other != position
+            ]
+        return results[:limit] if limit is not None else results
+
+    def __len__(self):
+        return len(self._names)
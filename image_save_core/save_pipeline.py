@@ -0,0 +1,263 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .perceptual_hash import hash_images
+
+# fsync の方針
+#   none: OS に任せる（最速）
+#   file: ファイルの内容を fsync してから rename
+#   full: さらに rename 後にフォルダも fsync（電源断でもエントリが残る）
+FSYNC_POLICIES = ("none", "file", "full")
+
+# 書き込みと同時にハッシュを計算する単位
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+# atomic_write の結果（保存先パスと内容の SHA-256）
+WriteResult = namedtuple("WriteResult", ["path", "digest"])
+
+# mkstemp は 0600 で作成するため、通常の open() と同じ権限に揃える
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+_ensured_directories = set()
+_ensured_lock = threading.Lock()
+
+
+def ensure_directory(directory):
+    """フォルダを作成（一度確認したフォルダは以後チェックしない）"""
+    if directory in _ensured_directories:
+        return
+    os.makedirs(directory, exist_ok=True)
+    with _ensured_lock:
+        _ensured_directories.add(directory)
+
+
+def forget_directory(directory):
+    """作成済みとして覚えたフォルダを忘れる（フォルダを削除した時など）"""
+    with _ensured_lock:
+        _ensured_directories.discard(directory)
+
+
+def fsync_directory(directory):
+    """フォルダのエントリ変更をディスクに反映"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _numbered_paths(filepath):
+    """filepath, stem_2.ext, stem_3.ext ... の順に候補を返す"""
+    yield filepath
+    stem, ext = os.path.splitext(filepath)
+    n = 2
+    while True:
+        yield f"{stem}_{n}{ext}"
+        n += 1
+
+
+def link_without_overwrite(src, filepath):
+    """src へのハードリンクを filepath に作成し、そのパスを返す
+
+    同名のファイルがあれば連番を付けた名前にする（既存ファイルは上書きしない）。
+    """
+    candidates = _numbered_paths(filepath)
+    candidate = next(candidates)
+    recreated = False
+    while True:
+        try:
+            os.link(src, candidate)
+            return candidate
+        except FileExistsError:
+            candidate = next(candidates)
+        except FileNotFoundError:
+            directory = os.path.dirname(candidate) or "."
+            if recreated or os.path.isdir(directory):
+                raise
+            # 確認済みのフォルダが外部で削除されていた場合は作り直す
+            forget_directory(directory)
+            ensure_directory(directory)
+            recreated = True
+
+
+def publish_file(src, filepath):
+    """src を filepath に移動する。既に同名のファイルがあれば連番を付けて上書きを避ける
+
+    ハードリンクで公開してから src を消すため、同じ名前への同時保存でも
+    既存のファイルが置き換わることはない。実際の保存先パスを返す。
+    """
+    try:
+        filepath = link_without_overwrite(src, filepath)
+    except OSError:
+        # ハードリンク非対応のファイルシステムでは存在確認してから rename
+        for candidate in _numbered_paths(filepath):
+            if not os.path.exists(candidate):
+                os.replace(src, candidate)
+                return candidate
+    os.remove(src)
+    return filepath
+
+
+def hash_file(filepath):
+    """ファイルの SHA-256 を少しずつ読み込んで計算"""
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(WRITE_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def atomic_write(filepath, data, fsync="none", exclusive=False):
+    """一時ファイルに書き込んでから rename し、書きかけのファイルを残さない
+
+    書き込みながら内容の SHA-256 を計算し、保存先パスとともに返す。
+    exclusive=True の場合は既存のファイルを上書きせず、連番を付けて保存する。
+    """
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError(f"不明な fsync 方針です: {fsync}")
+
+    directory = os.path.dirname(filepath) or "."
+    ensure_directory(directory)
+
+    # 一時ファイルは隠しファイル扱いにして一覧に出さない
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=".saving_", suffix=".tmp", dir=directory)
+    except FileNotFoundError:
+        # 確認済みのフォルダが外部で削除されていた場合は作り直す
+        forget_directory(directory)
+        ensure_directory(directory)
+        fd, tmp_path = tempfile.mkstemp(prefix=".saving_", suffix=".tmp", dir=directory)
+    try:
+        os.fchmod(fd, 0o666 & ~_UMASK)
+        hasher = hashlib.sha256()
+        view = memoryview(data).cast("B")
+        with os.fdopen(fd, "wb") as f:
+            for offset in range(0, len(view), WRITE_CHUNK_SIZE):
+                chunk = view[offset:offset + WRITE_CHUNK_SIZE]
+                hasher.update(chunk)
+                f.write(chunk)
+            if fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        if exclusive:
+            filepath = publish_file(tmp_path, filepath)
+        else:
+            os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if fsync == "full":
+        fsync_directory(directory)
+    return WriteResult(filepath, hasher.hexdigest())
+
+
+class SaveJob:
+    """まとめて依頼された保存の進捗"""
+
+    def __init__(self, total, label=""):
+        self.total = total
+        self.label = label
+        self.planned_files = []
+        self.saved_files = []
+        self.digests = {}
+        self.perceptual_hashes = {}
+        self.errors = []
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        if total == 0:
+            self._finished.set()
+
+    def _record(self, filepath=None, error=None, digest=None, perceptual_hash=None):
+        with self._lock:
+            if error is None:
+                self.saved_files.append(filepath)
+                self.digests[filepath] = digest
+                if perceptual_hash is not None:
+                    self.perceptual_hashes[filepath] = perceptual_hash
+            else:
+                self.errors.append((filepath, error))
+            if len(self.saved_files) + len(self.errors) >= self.total:
+                self._finished.set()
+
+    @property
+    def completed(self):
+        """処理が終わった枚数（失敗を含む）"""
+        with self._lock:
+            return len(self.saved_files) + len(self.errors)
+
+    @property
+    def progress(self):
+        """進捗率（0.0〜1.0）"""
+        return self.completed / self.total if self.total else 1.0
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """全ての保存が終わるまで待つ"""
+        return self._finished.wait(timeout)
+
+
+class SavePipeline:
+    """スレッドプールで画像を並列に書き込む保存パイプライン
+
+    待機中の書き込みは max_pending 件までで、それを超えると submit が
+    空きを待つため、溜め込んだバッファでメモリが膨らむことはない。
+    """
+
+    def __init__(self, max_workers=4, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-save")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def new_job(self, total, label=""):
+        """保存ジョブを作成"""
+        return SaveJob(total, label)
+
+    def submit(self, job, data, filepath, fsync="none", on_saved=None, transform=None, perceptual_hash=False):
+        """1枚分の書き込みを依頼（キューが一杯なら空くまで待つ）
+
+        transform を渡すと、書き込む前にワーカースレッドでバッファを変換する。
+        perceptual_hash=True なら、書き込んだ内容の知覚ハッシュもワーカースレッドで計算する。
+        """
+        self._slots.acquire()
+        job.planned_files.append(filepath)
+        try:
+            self._executor.submit(self._write, job, data, filepath, fsync, on_saved, transform, perceptual_hash)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _write(self, job, data, filepath, fsync, on_saved, transform, perceptual_hash):
+        try:
+            if transform is not None:
+                data = transform(data)
+            result = atomic_write(filepath, data, fsync)
+            # 読めない画像は None になり、後で一括計算する時にもう一度試す
+            phash = hash_images([data])[0] if perceptual_hash else None
+            if on_saved is not None:
+                on_saved(filepath)
+        except Exception as e:
+            job._record(filepath, error=str(e))
+        else:
+            job._record(filepath, digest=result.digest, perceptual_hash=phash)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        """全ての書き込みが終わるのを待って停止"""
+        self._executor.shutdown(wait=wait)
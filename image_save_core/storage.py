@@ -0,0 +1,514 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from . import metrics
+from .batch_staging import PendingImage, discard_pending, purge_staging
+from .image_index import is_image_filename
+from .image_probe import probe_image
+from .ingest import INGEST_PROFILES, is_passthrough, output_filename
+from .layout import LAYOUTS, date_shards, read_layout, shard_directory, write_layout
+from .perceptual_hash import hash_images
+from .save_pipeline import (
+    atomic_write, ensure_directory, forget_directory, fsync_directory, hash_file, link_without_overwrite,
+    publish_file,
+)
+from .trash import TrashResult, move_to_trash, purge_trash, restore_from_trash
+
+# 重複画像の扱い（skip: 保存しない / hardlink: 既存ファイルへのリンク / off: そのまま保存）
+DEDUP_POLICIES = ("skip", "hardlink", "off")
+
+# 一覧・枚数の取得で保存フォルダ全体を走査し直す最短の間隔（秒）
+RESCAN_INTERVAL = 2.0
+
+
+def camera_image_path(save_directory, image_number, timestamp, file_extension="jpg"):
+    """カメラ画像の保存先パスを作成"""
+    filename = f"camera_image_{timestamp}_{image_number:02d}.{file_extension}"
+    return os.path.join(save_directory, filename)
+
+
+def upload_image_path(save_directory, original_name, image_number, timestamp):
+    """アップロード画像の保存先パスを作成"""
+    file_extension = original_name.split('.')[-1]
+    filename = f"upload_image_{timestamp}_{image_number:02d}.{file_extension}"
+    return os.path.join(save_directory, filename)
+
+
+def find_duplicate(index, content_hash, batch_hashes=None, size=None):
+    """同じ内容の保存済み画像（同じバッチ内を含む）のパスを取得。無ければ None
+
+    size を渡すと、内容のハッシュが未計算の画像（以前から保存フォルダにあった画像や
+    外から追加された画像）のうち、同じバイト数のものだけをその場で計算して比べる。
+    """
+    if batch_hashes and content_hash in batch_hashes:
+        return batch_hashes[content_hash]
+    existing = index.find_by_hash(content_hash)
+    if existing is not None and os.path.exists(existing):
+        return existing
+    if size is not None:
+        for filepath in index.unhashed_with_size(size):
+            try:
+                digest = hash_file(filepath)
+            except OSError:
+                continue
+            index.set_content_hashes([(filepath, digest)])
+            if digest == content_hash:
+                return filepath
+    return None
+
+
+def store_duplicate(index, existing, filepath, size, dedup):
+    """重複画像を方針に従って保存し、保存先パスを返す（skip は既存のパスを返す）"""
+    index.record_duplicate(size)
+    if dedup == "hardlink":
+        ensure_directory(os.path.dirname(filepath))
+        return link_without_overwrite(existing, filepath)
+    return existing
+
+
+def _shards_in_range(save_directory, start_time, end_time):
+    """日付で分けた保存フォルダなら、期間に含まれる日付フォルダだけを返す（それ以外は None）"""
+    if read_layout(save_directory) != "date":
+        return None
+    return date_shards(start_time, end_time)
+
+
+def _rescan(index, start_time, end_time):
+    """一覧の前にフォルダを走査（RESCAN_INTERVAL 以内に全体を走査済みなら省く）"""
+    index.reconcile(
+        subdirectories=_shards_in_range(index.save_directory, start_time, end_time), max_age=RESCAN_INTERVAL,
+    )
+
+
+@metrics.timed("list_images")
+def list_saved_images(index, start_time=None, end_time=None, limit=None, offset=0, rescan=True):
+    """保存されている画像のメタデータ一覧を取得（新しい順、期間・件数で絞り込み可能）
+
+    フォルダ監視（DirectoryWatcher）でインデックスを更新している場合は rescan=False で走査を省ける。
+    """
+    if not os.path.exists(index.save_directory):
+        return []
+    if rescan:
+        _rescan(index, start_time, end_time)
+    return index.list_records(start_time, end_time, limit, offset)
+
+
+@metrics.timed("count_images")
+def count_saved_images(index, start_time=None, end_time=None, rescan=True):
+    """保存されている画像の枚数を取得（期間で絞り込み可能）"""
+    if not os.path.exists(index.save_directory):
+        return 0
+    if rescan:
+        _rescan(index, start_time, end_time)
+    return index.count_records(start_time, end_time)
+
+
+@metrics.timed("save_images")
+def save_images(uploaded_files, index, fsync="none", dedup="off", digests=None, start_number=1,
+                source="upload", file_cache=None, staging_errors=None, perceptual_hashes=None):
+    """カメラ/アップロードの画像を保存し、(保存先パスのリスト, 失敗のリスト) を返す
+
+    保存待ち画像（PendingImage）は一時ファイルを rename するだけでまとめて保存する。
+    dedup が "skip" なら同じ内容の画像は保存せず既存のパスを返し、"hardlink" なら
+    既存ファイルへのハードリンクとして保存する。digests には一時ファイルの
+    パスから SHA-256 への対応（保存ジョブの digests）を、perceptual_hashes には知覚ハッシュへの
+    対応（保存ジョブの perceptual_hashes）を、staging_errors には一時ファイルへの
+    書き込みに失敗したパスからエラーメッセージへの対応を渡す。知覚ハッシュの無い画像は
+    ここでは計算せず、backfill_perceptual_hashes で後から計算する。
+    失敗した画像は飛ばし、(ファイル名, エラーメッセージ) を失敗のリストに入れる。
+    """
+    save_directory = index.save_directory
+    layout = read_layout(save_directory)
+    new_files = {}
+    ordered_files = []
+    errors = []
+    batch_hashes = {}
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+
+    try:
+        for i, uploaded_file in enumerate(uploaded_files, start_number):
+            name = getattr(uploaded_file, "name", None) or f"{source}.jpg"
+            if isinstance(uploaded_file, PendingImage) and uploaded_file.staged_path in (staging_errors or {}):
+                # 受け取りに失敗した画像（変換できない画像など）は保存しない
+                discard_pending([uploaded_file])
+                errors.append((name, staging_errors[uploaded_file.staged_path]))
+                continue
+            try:
+                filepath = _save_one(
+                    uploaded_file, i, index, layout, now, timestamp, fsync, dedup, digests, perceptual_hashes, source,
+                    batch_hashes, new_files,
+                )
+            except OSError as e:
+                if isinstance(uploaded_file, PendingImage):
+                    discard_pending([uploaded_file])
+                errors.append((name, e.strerror or str(e)))
+                continue
+            ordered_files.append(filepath)
+
+        if fsync == "full" and ordered_files:
+            for directory in {os.path.dirname(filepath) for filepath in ordered_files}:
+                fsync_directory(directory)
+    finally:
+        # 途中で失敗しても、保存できた画像は必ずインデックスに登録する
+        if file_cache is not None:
+            # 同じパスに以前あったファイルの内容がキャッシュに残らないようにする
+            file_cache.invalidate_many(ordered_files)
+        # インデックスへの登録も1回のトランザクションで行う
+        for item_source, (filepaths, content_hashes, phashes) in new_files.items():
+            index.add_many(filepaths, source=item_source, content_hashes=content_hashes, perceptual_hashes=phashes)
+
+    return ordered_files, errors
+
+
+def _save_one(uploaded_file, image_number, index, layout, now, timestamp, fsync, dedup, digests, perceptual_hashes,
+              source, batch_hashes, new_files):
+    """save_images の1枚分。保存先パスを返し、新しく書き込んだ画像は new_files に追加する"""
+    save_directory = index.save_directory
+    if isinstance(uploaded_file, PendingImage):
+        item_source = uploaded_file.source
+        staged_path = uploaded_file.staged_path
+        content_hash = (digests or {}).get(staged_path) or hash_file(staged_path)
+        perceptual_hash = (perceptual_hashes or {}).get(staged_path)
+        size = os.path.getsize(staged_path)
+    else:
+        item_source = source
+        staged_path = None
+        buffer = uploaded_file.getbuffer()
+        content_hash = hashlib.sha256(buffer).hexdigest()
+        perceptual_hash = None
+        size = len(buffer)
+
+    if item_source == "camera":
+        filepath = camera_image_path(
+            save_directory, image_number, timestamp, getattr(uploaded_file, "name", "camera.jpg").split('.')[-1]
+        )
+    else:
+        filepath = upload_image_path(save_directory, uploaded_file.name, image_number, timestamp)
+    if layout != "flat":
+        filepath = os.path.join(shard_directory(save_directory, layout, filepath, now), os.path.basename(filepath))
+
+    existing = find_duplicate(index, content_hash, batch_hashes, size) if dedup != "off" else None
+    if existing is not None:
+        # 同じ内容の画像は書き込まない
+        if staged_path is not None:
+            discard_pending([uploaded_file])
+        filepath = store_duplicate(index, existing, filepath, size, dedup)
+        if dedup == "skip":
+            return filepath
+    elif staged_path is not None:
+        ensure_directory(os.path.dirname(filepath))
+        filepath = publish_file(staged_path, filepath)
+    else:
+        filepath = atomic_write(filepath, buffer, fsync, exclusive=True).path
+
+    batch_hashes.setdefault(content_hash, filepath)
+    filepaths, content_hashes, phashes = new_files.setdefault(item_source, ([], [], []))
+    filepaths.append(filepath)
+    content_hashes.append(content_hash)
+    phashes.append(perceptual_hash)
+    return filepath
+
+
+@metrics.timed("delete_images")
+def delete_images(filepaths, index, file_cache=None):
+    """画像をまとめてゴミ箱に移動し、ファイルごとの結果（TrashResult）を返す
+
+    元に戻す時のために、保存元とハッシュは移動する前に読んでおく
+    （移動中にフォルダ監視が先にインデックスから除外することがあるため）。
+    """
+    kept_info = index.kept_info(filepaths)
+    result = move_to_trash(filepaths, index.save_directory)
+    if result.moved:
+        moved_files = [original for original, _ in result.moved]
+        index.remove_many(moved_files, [trashed for _, trashed in result.moved], kept_info)
+        if file_cache is not None:
+            file_cache.invalidate_many(moved_files)
+    return result
+
+
+def restore_images(moved, index):
+    """ゴミ箱に移動した画像を元に戻す（保存元と内容・知覚ハッシュも削除前の状態に戻す）"""
+    result = restore_from_trash(moved)
+    if result.moved:
+        index.restore_many(result.moved)
+    return result
+
+
+def find_image_files(directory, recursive=False):
+    """フォルダ内の画像ファイルを列挙（隠しファイル・隠しフォルダは除く）"""
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith(".")) if recursive else []
+        for filename in sorted(filenames):
+            if is_image_filename(filename) and not filename.startswith("."):
+                yield os.path.join(root, filename)
+
+
+def _read_source(filepath):
+    """取り込む画像を読み込み、ヘッダーから形式を判定して返す"""
+    with open(filepath, "rb") as f:
+        data = f.read()
+    try:
+        source_format = probe_image(io.BytesIO(data)).format
+    except Exception:
+        source_format = None
+    return data, source_format
+
+
+@metrics.timed("import_files")
+def import_files(filepaths, index, profile=INGEST_PROFILES["original"], dedup="skip", fsync="none",
+                 processor=None, max_workers=8, chunk_size=64, on_progress=None):
+    """画像ファイルをまとめて取り込み、(保存した枚数, 重複の枚数, 失敗のリスト) を返す
+
+    chunk_size 枚ずつ、読み込みとハッシュ計算・書き込みはスレッドで、
+    縮小・形式変換はプロセスプールで並列に行う。ファイル名は元の名前を使い、
+    同名のファイルがあれば連番を付ける。
+    """
+    save_directory = index.save_directory
+    ensure_directory(save_directory)
+    layout = read_layout(save_directory)
+    transcoding = processor is not None and not is_passthrough(profile)
+    saved = 0
+    duplicates = 0
+    errors = []
+    batch_hashes = {}
+
+    def write(item):
+        _, target, data, _ = item
+        return atomic_write(target, data, fsync, exclusive=True).path
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(filepaths), chunk_size):
+            chunk = filepaths[start:start + chunk_size]
+
+            loaded = []
+            for filepath, future in [(filepath, executor.submit(_read_source, filepath)) for filepath in chunk]:
+                try:
+                    data, source_format = future.result()
+                except OSError as e:
+                    errors.append((filepath, e.strerror or str(e)))
+                    continue
+                name = os.path.basename(filepath)
+                if transcoding and source_format is not None:
+                    name = output_filename(name, source_format, profile)
+                loaded.append((filepath, os.path.join(shard_directory(save_directory, layout, name), name), data))
+
+            if transcoding:
+                try:
+                    converted = processor.transcode_many([data for _, _, data in loaded], profile)
+                except Exception:
+                    # 変換できない画像が混ざっていた場合は1枚ずつやり直して特定する
+                    converted = []
+                    for filepath, _, data in loaded:
+                        try:
+                            converted.append(processor.transcode(data, profile))
+                        except Exception as e:
+                            errors.append((filepath, str(e)))
+                            converted.append(None)
+                loaded = [
+                    (filepath, target, data)
+                    for (filepath, target, _), data in zip(loaded, converted) if data is not None
+                ]
+
+            hashes = list(executor.map(lambda item: hashlib.sha256(item[2]).hexdigest(), loaded))
+            # 同じ内容の画像は知覚ハッシュも同じなので、内容のハッシュから引けるようにしておく
+            perceptual_hashes = dict(zip(hashes, hash_images([data for _, _, data in loaded], executor)))
+
+            # 重複の判定は順序に依存するため、ハッシュ計算後に1スレッドで行う
+            writes = []
+            links = []
+            pending_hashes = set()
+            for (filepath, target, data), content_hash in zip(loaded, hashes):
+                if dedup != "off" and content_hash in pending_hashes:
+                    # 同じチャンク内の重複は、先の画像を書き込んでからリンクする
+                    duplicates += 1
+                    index.record_duplicate(len(data))
+                    if dedup == "hardlink":
+                        links.append((filepath, target, content_hash))
+                    continue
+                existing = find_duplicate(index, content_hash, batch_hashes, len(data)) if dedup != "off" else None
+                if existing is not None:
+                    duplicates += 1
+                    index.record_duplicate(len(data))
+                    if dedup == "hardlink":
+                        links.append((filepath, target, content_hash))
+                    batch_hashes.setdefault(content_hash, existing)
+                    continue
+                pending_hashes.add(content_hash)
+                writes.append((filepath, target, data, content_hash))
+
+            saved_paths = []
+            saved_hashes = []
+            for item, future in [(item, executor.submit(write, item)) for item in writes]:
+                filepath, _, _, content_hash = item
+                try:
+                    saved_paths.append(future.result())
+                except OSError as e:
+                    errors.append((filepath, e.strerror or str(e)))
+                    continue
+                saved_hashes.append(content_hash)
+                batch_hashes[content_hash] = saved_paths[-1]
+
+            for filepath, target, content_hash in links:
+                try:
+                    ensure_directory(os.path.dirname(target))
+                    saved_paths.append(link_without_overwrite(batch_hashes[content_hash], target))
+                except (KeyError, OSError) as e:
+                    errors.append((filepath, getattr(e, "strerror", None) or "リンク先の画像を保存できませんでした"))
+                    continue
+                saved_hashes.append(content_hash)
+
+            if fsync == "full" and saved_paths:
+                for directory in {os.path.dirname(path) for path in saved_paths}:
+                    fsync_directory(directory)
+            if saved_paths:
+                index.add_many(
+                    saved_paths, source="external", content_hashes=saved_hashes,
+                    perceptual_hashes=[perceptual_hashes[content_hash] for content_hash in saved_hashes],
+                )
+            saved += len(saved_paths)
+            if on_progress is not None:
+                on_progress(min(start + chunk_size, len(filepaths)), len(filepaths))
+
+    return saved, duplicates, errors
+
+
+@metrics.timed("backfill_content_hashes")
+def backfill_content_hashes(index, max_workers=8, chunk_size=256, on_progress=None):
+    """内容のハッシュの無い保存済み画像をまとめて計算し、(計算した枚数, 読めなかった枚数) を返す
+
+    以前から保存フォルダにあった画像や外から追加された画像も、重複の判定で比べられるようにする。
+    読み込みとハッシュ計算は chunk_size 枚ずつスレッドで並列に行う。
+    """
+    index.reconcile()
+    filepaths = index.missing_content_hashes()
+    if not filepaths:
+        return 0, 0
+
+    def digest(filepath):
+        try:
+            return hash_file(filepath)
+        except OSError:
+            return None
+
+    hashed = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(filepaths), chunk_size):
+            chunk = filepaths[start:start + chunk_size]
+            pairs = [
+                (filepath, content_hash)
+                for filepath, content_hash in zip(chunk, executor.map(digest, chunk)) if content_hash is not None
+            ]
+            index.set_content_hashes(pairs)
+            hashed += len(pairs)
+            failed += len(chunk) - len(pairs)
+            if on_progress is not None:
+                on_progress(start + len(chunk), len(filepaths))
+    return hashed, failed
+
+
+@metrics.timed("backfill_perceptual_hashes")
+def backfill_perceptual_hashes(index, max_workers=None, chunk_size=256, on_progress=None):
+    """知覚ハッシュの無い保存済み画像をまとめて計算し、(計算した枚数, 読めなかった枚数) を返す
+
+    chunk_size 枚ずつプロセスプールに渡し、全ての CPU コアでデコードと縮小を行う。
+    """
+    index.reconcile()
+    filepaths = index.missing_perceptual_hashes()
+    if not filepaths:
+        return 0, 0
+
+    chunks = [filepaths[start:start + chunk_size] for start in range(0, len(filepaths), chunk_size)]
+    hashed = 0
+    failed = 0
+    done = 0
+    # Streamlit はスレッドを使うため fork ではなく spawn で起動する
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        for chunk, values in zip(chunks, executor.map(hash_images, chunks)):
+            pairs = [(filepath, value) for filepath, value in zip(chunk, values) if value is not None]
+            index.set_perceptual_hashes(pairs)
+            hashed += len(pairs)
+            failed += len(chunk) - len(pairs)
+            done += len(chunk)
+            if on_progress is not None:
+                on_progress(done, len(filepaths))
+    return hashed, failed
+
+
+def prune(index, older_than_days=None, trash_days=7, file_cache=None):
+    """古い画像のゴミ箱への移動と、期限切れのゴミ箱・一時ファイルの削除
+
+    older_than_days を指定すると、それより前に保存された画像をゴミ箱に移動する。
+    (ゴミ箱に移動した結果, 完全に削除したゴミ箱のフォルダ数, 削除した一時ファイル数) を返す。
+    """
+    save_directory = index.save_directory
+    moved = TrashResult([], [])
+    if older_than_days is not None:
+        cutoff = time.time() - older_than_days * 24 * 60 * 60
+        old_files = [record.path for record in list_saved_images(index, end_time=cutoff)]
+        if old_files:
+            moved = delete_images(old_files, index, file_cache)
+    purged = purge_trash(save_directory, trash_days * 24 * 60 * 60)
+    staged = purge_staging(save_directory)
+    return moved, purged, staged
+
+
+def _remove_empty_directories(save_directory):
+    """保存フォルダ内の空になったサブフォルダを削除（隠しフォルダは除く）"""
+    for root, dirnames, filenames in os.walk(save_directory, topdown=False):
+        if root == save_directory or os.path.basename(root).startswith("."):
+            continue
+        if os.path.relpath(root, save_directory).split(os.sep)[0].startswith("."):
+            continue
+        try:
+            os.rmdir(root)
+        except OSError:
+            continue
+        # 次に同じフォルダへ保存する時に作り直させる
+        forget_directory(root)
+
+
+@metrics.timed("migrate_layout")
+def migrate_layout(index, layout, file_cache=None, on_progress=None):
+    """保存済みの画像を指定した分け方のフォルダに移動し、(移動した枚数, 失敗のリスト) を返す
+
+    先に設定を切り替えるため、移動中に保存された画像も新しい分け方で保存される。
+    date の日付は各画像の更新時刻から決める。
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"不明な保存レイアウトです: {layout}")
+    save_directory = index.save_directory
+    write_layout(save_directory, layout)
+    index.reconcile(force=True)
+    records = index.list_records()
+    # フォルダ監視が移動を先に反映してもハッシュを引き継げるよう、移動する前に読んでおく
+    kept_info = index.kept_info([record.path for record in records])
+
+    moves = []
+    errors = []
+    for n, record in enumerate(records, 1):
+        directory = shard_directory(save_directory, layout, record.name, datetime.fromtimestamp(record.mtime))
+        if os.path.normpath(os.path.dirname(record.path)) != os.path.normpath(directory):
+            try:
+                ensure_directory(directory)
+                moves.append((record.path, publish_file(record.path, os.path.join(directory, os.path.basename(record.path)))))
+            except OSError as e:
+                errors.append((record.path, e.strerror or str(e)))
+        if on_progress is not None and (n % 256 == 0 or n == len(records)):
+            on_progress(n, len(records))
+
+    if moves:
+        index.rename_many(moves, kept_info)
+        if file_cache is not None:
+            file_cache.invalidate_many([src for src, _ in moves])
+    _remove_empty_directories(save_directory)
+    index.reconcile(force=True)
+    return len(moves), errors
@@ -0,0 +1,43 @@
+import threading
+
+
+class BackgroundTask:
+    """時間のかかる処理（ハッシュの一括計算など）を別スレッドで実行し、進捗を保持する
+
+    target は on_progress(終わった数, 全体の数) を受け取る関数で、戻り値は result に入る。
+    """
+
+    def __init__(self, target, label=""):
+        self.label = label
+        self.completed = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(target,), name="background-task", daemon=True)
+        self._thread.start()
+
+    def _on_progress(self, completed, total):
+        self.completed = completed
+        self.total = total
+
+    def _run(self, target):
+        try:
+            self.result = target(on_progress=self._on_progress)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._finished.set()
+
+    @property
+    def progress(self):
+        """進捗率（0.0〜1.0、全体の数が分かるまでは 0.0）"""
+        return self.completed / self.total if self.total else 0.0
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """処理が終わるまで待つ"""
+        return self._finished.wait(timeout)
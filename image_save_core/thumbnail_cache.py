@@ -0,0 +1,143 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from . import metrics
+
+# 保存フォルダ内に作るサムネイル用のサイドカーディレクトリ
+THUMBNAIL_DIR_NAME = ".thumbnails"
+
+
+class ThumbnailCache:
+    """縮小サムネイルをディスクとメモリ(LRU)にキャッシュするクラス"""
+
+    def __init__(self, save_directory="saved_images", max_edge=320, quality=80,
+                 memory_limit_bytes=32 * 1024 * 1024, disk_limit_bytes=256 * 1024 * 1024):
+        self.cache_directory = os.path.join(save_directory, THUMBNAIL_DIR_NAME)
+        self.max_edge = max_edge
+        self.quality = quality
+        self.memory_limit_bytes = memory_limit_bytes
+        self.disk_limit_bytes = disk_limit_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # 初回書き込み時にディレクトリを走査して算出
+        self._lock = threading.Lock()
+
+    def _cache_key(self, filepath, stat):
+        """パス・更新時刻・サイズ・サムネイル寸法からキャッシュキーを作成"""
+        raw = f"{os.path.abspath(filepath)}|{stat.st_mtime_ns}|{stat.st_size}|{self.max_edge}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, filepath):
+        """サムネイル(JPEGのバイト列)を取得。無ければ生成してキャッシュする"""
+        stat = os.stat(filepath)
+        key = self._cache_key(filepath, stat)
+
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                metrics.count("thumbnail_memory_hits")
+                return data
+
+        thumb_path = os.path.join(self.cache_directory, f"{key}.jpg")
+        try:
+            with open(thumb_path, "rb") as f:
+                data = f.read()
+            # ディスク側のLRU判定用にアクセス時刻を更新
+            os.utime(thumb_path)
+            metrics.count("thumbnail_disk_hits")
+        except FileNotFoundError:
+            metrics.count("thumbnail_generated")
+            data = self._generate(filepath)
+            self._write_disk(thumb_path, data)
+
+        self._remember(key, data)
+        return data
+
+    @metrics.timed("thumbnail_decode")
+    def _generate(self, filepath):
+        """元画像からサムネイルを生成"""
+        from PIL import Image, ImageOps
+
+        with Image.open(filepath) as image:
+            # JPEGはデコード時に縮小させて全画素の展開を避ける
+            image.draft("RGB", (self.max_edge, self.max_edge))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((self.max_edge, self.max_edge))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        return buffer.getvalue()
+
+    def _remember(self, key, data):
+        """メモリ上のLRUに登録し、上限を超えた分を古い順に破棄"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_limit_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _write_disk(self, thumb_path, data):
+        """サムネイルをディスクに書き込み、合計サイズが上限を超えたら古いものから削除"""
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+        tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, thumb_path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_usage()
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_limit_bytes:
+                self._evict_disk()
+
+    def _scan_disk_usage(self):
+        """キャッシュディレクトリの合計サイズを取得"""
+        total = 0
+        with os.scandir(self.cache_directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".jpg"):
+                    total += entry.stat().st_size
+        return total
+
+    def _evict_disk(self):
+        """アクセスの古いサムネイルから削除して上限の9割まで減らす"""
+        entries = []
+        with os.scandir(self.cache_directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".jpg"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_limit_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def clear_memory(self):
+        """メモリ上のキャッシュを破棄"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
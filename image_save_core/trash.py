@@ -0,0 +1,127 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 保存フォルダ内に作るゴミ箱ディレクトリ
+TRASH_DIR_NAME = ".trash"
+
+# ゴミ箱に残しておく期間
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# これより多い枚数は複数スレッドで移動する
+PARALLEL_THRESHOLD = 256
+
+# moved: (元のパス, ゴミ箱内のパス) のリスト / errors: (パス, エラーメッセージ) のリスト
+TrashResult = namedtuple("TrashResult", ["moved", "errors"])
+
+
+def trash_directory(save_directory):
+    """ゴミ箱の場所"""
+    return os.path.join(save_directory, TRASH_DIR_NAME)
+
+
+def _rename(src, dest):
+    """1ファイルを移動（フォルダが無ければ作ってからやり直す）"""
+    try:
+        os.rename(src, dest)
+    except FileNotFoundError:
+        if not os.path.exists(src):
+            raise
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.rename(src, dest)
+
+
+def _move_all(pairs, max_workers):
+    """(元, 先) の組をまとめて移動し、成功と失敗を分けて返す"""
+    def move(pair):
+        src, dest = pair
+        try:
+            _rename(src, dest)
+            return pair, None
+        except OSError as e:
+            return pair, e.strerror or str(e)
+
+    if len(pairs) > PARALLEL_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(move, pairs))
+    else:
+        results = [move(pair) for pair in pairs]
+
+    moved = [pair for pair, error in results if error is None]
+    errors = [(pair[0], error) for pair, error in results if error is not None]
+    return TrashResult(moved, errors)
+
+
+def move_to_trash(filepaths, save_directory, max_workers=8):
+    """画像をゴミ箱に移動（1ファイル1回の rename）し、ファイルごとの結果を返す
+
+    1回の呼び出しで移動したファイルは、ゴミ箱内の同じバッチフォルダにまとめる。
+    """
+    batch_directory = os.path.join(
+        trash_directory(save_directory), f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    )
+    os.makedirs(batch_directory, exist_ok=True)
+
+    pairs = [
+        (filepath, os.path.join(batch_directory, os.path.relpath(filepath, save_directory)))
+        for filepath in filepaths
+    ]
+    return _move_all(pairs, max_workers)
+
+
+def restore_from_trash(moved, max_workers=8):
+    """move_to_trash で移動したファイルを元の場所に戻す"""
+    pairs = []
+    errors = []
+    for original, trashed in moved:
+        if os.path.exists(original):
+            errors.append((original, "同じ名前のファイルが既にあります"))
+        else:
+            pairs.append((trashed, original))
+    result = _move_all(pairs, max_workers)
+    restored = [(original, trashed) for trashed, original in result.moved]
+    return TrashResult(restored, errors + result.errors)
+
+
+def purge_trash(save_directory, max_age_seconds=DEFAULT_RETENTION_SECONDS):
+    """古いバッチフォルダをゴミ箱から完全に削除し、削除したフォルダ数を返す"""
+    directory = trash_directory(save_directory)
+    if not os.path.isdir(directory):
+        return 0
+
+    cutoff = time.time() - max_age_seconds
+    purged = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path)
+                    purged += 1
+            except OSError:
+                pass
+    return purged
+
+
+class TrashPurger:
+    """古いゴミ箱を定期的に削除するバックグラウンドスレッド"""
+
+    def __init__(self, save_directory, interval_seconds=60 * 60, max_age_seconds=DEFAULT_RETENTION_SECONDS):
+        self.save_directory = save_directory
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trash-purger", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            purge_trash(self.save_directory, self.max_age_seconds)
+            if self._stop.wait(self.interval_seconds):
+                return
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import zipfile
+
+from . import metrics
+
+# ファイルを読み込む単位（この大きさずつ ZIP に書き出す）
+CHUNK_SIZE = 1024 * 1024
+
+# 既に圧縮済みの形式は再圧縮せずにそのまま格納する
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+# 見つからずに飛ばしたファイルの一覧を書く ZIP 内のファイル名
+MISSING_FILES_NAME = "_missing_files.txt"
+
+
+class _ChunkSink:
+    """ZipFile の書き込み先。書かれたバイト列を取り出されるまで溜めておく"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """溜まっているバイト列を取り出す"""
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def _unique_arcnames(filepaths):
+    """ZIP 内のファイル名を重複しないように作成"""
+    used = set()
+    for filepath in filepaths:
+        name = os.path.basename(filepath)
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while name in used:
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        used.add(name)
+        yield name
+
+
+def _compress_type(filepath):
+    """拡張子に応じて格納方式を選択"""
+    if filepath.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip_chunks(filepaths, arcnames=None, chunk_size=CHUNK_SIZE, skipped=None):
+    """画像を ZIP にまとめながらバイト列を少しずつ返すジェネレータ
+
+    各ファイルは chunk_size ずつ読み込むため、画像の枚数や合計サイズに
+    関係なく使用メモリは一定に保たれる。一覧を取得した後に削除された
+    ファイルは飛ばし、skipped（リスト）を渡すと (パス, エラーメッセージ) を追加する。
+    """
+    if arcnames is None:
+        arcnames = _unique_arcnames(filepaths)
+
+    sink = _ChunkSink()
+    # 書き込み先がシーク不可のため、サイズと CRC はデータ記述子に書かれる
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        for filepath, arcname in zip(filepaths, arcnames):
+            try:
+                info = zipfile.ZipInfo.from_file(filepath, arcname)
+                src = open(filepath, "rb")
+            except OSError as e:
+                if skipped is not None:
+                    skipped.append((filepath, e.strerror or str(e)))
+                continue
+            info.compress_type = _compress_type(filepath)
+            with src, archive.open(info, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def write_zip(filepaths, fileobj, arcnames=None, skipped=None):
+    """ZIP を fileobj に少しずつ書き込み、書き込んだバイト数を返す"""
+    written = 0
+    for chunk in iter_zip_chunks(filepaths, arcnames, skipped=skipped):
+        fileobj.write(chunk)
+        written += len(chunk)
+    return written
+
+
+@metrics.timed("zip_build")
+def build_zip_archive(filepaths, arcnames=None):
+    """ZIP を一時ファイルに作成し、読み込み用に開いたファイルオブジェクトを返す
+
+    一時ファイルは開いた直後に削除するため、閉じれば領域も解放される。
+    見つからなかったファイルがあれば、その一覧を MISSING_FILES_NAME として ZIP に含める。
+    """
+    filepaths = list(filepaths)
+    if arcnames is None:
+        arcnames = list(_unique_arcnames(filepaths))
+    fd, tmp_path = tempfile.mkstemp(suffix=".zip")
+    try:
+        skipped = []
+        with os.fdopen(fd, "w+b") as f:
+            write_zip(filepaths, f, arcnames, skipped)
+            if skipped:
+                # ブラウザからのダウンロードでは画面に出せないため、ZIP の中で知らせる
+                f.seek(0)
+                with zipfile.ZipFile(f, "a") as archive:
+                    archive.writestr(
+                        MISSING_FILES_NAME, "".join(f"{filepath}: {error}\n" for filepath, error in skipped),
+                    )
+        return open(tmp_path, "rb")
+    finally:
+        os.remove(tmp_path)
+
+
+def export_zip(filepaths, destination, arcnames=None, skipped=None):
+    """ZIP をファイルとして保存（一時ファイルに書いてから置き換える）
+
+    画像は少しずつ書き込むため、合計サイズに関係なく使用メモリは一定に保たれる。
+    """
+    tmp_path = f"{destination}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            write_zip(filepaths, f, arcnames, skipped)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.replace(tmp_path, destination)
+    return destination
@@ -1,6 +1,318 @@
-def main():
-    print("Hello from image-save-app!")
+"""画像保存アプリのコマンドライン版（Streamlit を使わずに取り込み・一覧・整理を行う）
+
+使い方:
+    python main.py ingest DIR [--save-dir saved_images] [--profile jpeg_standard]
+    python main.py list [--since 2024-01-01] [--limit 20]
+    python main.py export photos.zip [--since 2024-01-01]
+    python main.py prune [--older-than 90]
+    python main.py migrate --layout date
+    python main.py hash
+    python main.py similar saved_images/photo.jpg [--max-distance 6]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+
+def _parse_date(value):
+    """YYYY-MM-DD を UNIX 時刻に変換"""
+    return datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def cmd_ingest(args):
+    """フォルダ内の画像をまとめて保存フォルダに取り込む"""
+    from image_save_core import ImageIndex, find_image_files, import_files
+    from image_save_core.ingest import INGEST_PROFILES, IngestProcessor, is_passthrough
+
+    if not os.path.isdir(args.directory):
+        print(f"フォルダが見つかりません: {args.directory}", file=sys.stderr)
+        return 1
+
+    profile = INGEST_PROFILES[args.profile]
+    filepaths = list(find_image_files(args.directory, recursive=args.recursive))
+    if not filepaths:
+        print("取り込む画像がありません")
+        return 0
+
+    index = ImageIndex(args.save_dir)
+    # 縮小・形式変換がある時だけプロセスプールを起動する
+    processor = None if is_passthrough(profile) else IngestProcessor(args.processes)
+
+    def on_progress(done, total):
+        if not args.quiet:
+            print(f"\r{done}/{total} 枚を処理", end="", file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    try:
+        saved, duplicates, errors = import_files(
+            filepaths, index, profile, dedup=args.dedup, fsync=args.fsync, processor=processor,
+            max_workers=args.workers, on_progress=on_progress,
+        )
+    finally:
+        if processor is not None:
+            processor.shutdown()
+        index.close()
+    elapsed = time.perf_counter() - started
+
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(f"{saved} 枚を保存しました（重複 {duplicates} 枚、失敗 {len(errors)} 枚、{elapsed:.2f} 秒）")
+    for filepath, error in errors:
+        print(f"  {filepath}: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def _parse_range(args):
+    """--since / --until を UNIX 時刻の期間に変換（--until の日を含む）"""
+    start_time = _parse_date(args.since) if args.since else None
+    end_time = None
+    if args.until:
+        end_time = (datetime.strptime(args.until, "%Y-%m-%d") + timedelta(days=1)).timestamp()
+    return start_time, end_time
+
+
+def cmd_list(args):
+    """保存済みの画像を新しい順に表示"""
+    from image_save_core import ImageIndex, list_saved_images
+
+    start_time, end_time = _parse_range(args)
+    index = ImageIndex(args.save_dir)
+    try:
+        records = list_saved_images(index, start_time, end_time, args.limit)
+    finally:
+        index.close()
+
+    if args.json:
+        json.dump([record._asdict() for record in records], sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    for record in records:
+        modified = datetime.fromtimestamp(record.mtime).strftime("%Y/%m/%d %H:%M")
+        width, height = record.display_size
+        resolution = f"{width}x{height}" if width else "-"
+        print(f"{modified}  {record.size / 1024:9.1f}KB  {resolution:>11}  {record.name}")
+    return 0
+
+
+def cmd_export(args):
+    """保存済みの画像（期間指定可）を ZIP ファイルに書き出す"""
+    from image_save_core import ImageIndex, list_saved_images
+    from image_save_core.zip_export import export_zip
+
+    if not os.path.isdir(args.save_dir):
+        print(f"フォルダが見つかりません: {args.save_dir}", file=sys.stderr)
+        return 1
+
+    start_time, end_time = _parse_range(args)
+    index = ImageIndex(args.save_dir)
+    try:
+        filepaths = [record.path for record in list_saved_images(index, start_time, end_time)]
+    finally:
+        index.close()
+
+    # 画像は少しずつ書き込むため、枚数や合計サイズに関係なく使用メモリは一定
+    started = time.perf_counter()
+    skipped = []
+    export_zip(filepaths, args.destination, skipped=skipped)
+    elapsed = time.perf_counter() - started
+
+    size = os.path.getsize(args.destination)
+    print(
+        f"{len(filepaths) - len(skipped)} 枚を {args.destination} に書き出しました"
+        f"（{size / 1024 / 1024:.1f} MB、見つからない画像 {len(skipped)} 枚、{elapsed:.2f} 秒）"
+    )
+    for filepath, error in skipped:
+        print(f"  {filepath}: {error}", file=sys.stderr)
+    return 0
+
+
+def cmd_prune(args):
+    """古い画像をゴミ箱に移動し、期限切れのゴミ箱と一時ファイルを削除"""
+    from image_save_core import ImageIndex, prune
+
+    if not os.path.isdir(args.save_dir):
+        print(f"フォルダが見つかりません: {args.save_dir}", file=sys.stderr)
+        return 1
+
+    index = ImageIndex(args.save_dir)
+    try:
+        moved, purged, staged = prune(index, args.older_than, args.trash_days)
+    finally:
+        index.close()
+
+    print(
+        f"ゴミ箱に移動: {len(moved.moved)} 枚 / 削除したゴミ箱: {purged} 件 / 削除した一時ファイル: {staged} 件"
+    )
+    for filepath, error in moved.errors:
+        print(f"  {filepath}: {error}", file=sys.stderr)
+    return 1 if moved.errors else 0
+
+
+def cmd_migrate(args):
+    """保存フォルダの分け方を変更し、保存済みの画像を移動する"""
+    from image_save_core import ImageIndex, migrate_layout
+
+    if not os.path.isdir(args.save_dir):
+        print(f"フォルダが見つかりません: {args.save_dir}", file=sys.stderr)
+        return 1
+
+    def on_progress(done, total):
+        if not args.quiet:
+            print(f"\r{done}/{total} 枚を確認", end="", file=sys.stderr, flush=True)
+
+    index = ImageIndex(args.save_dir)
+    started = time.perf_counter()
+    try:
+        moved, errors = migrate_layout(index, args.layout, on_progress=on_progress)
+    finally:
+        index.close()
+    elapsed = time.perf_counter() - started
+
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(f"{moved} 枚を移動しました（失敗 {len(errors)} 枚、{elapsed:.2f} 秒）")
+    for filepath, error in errors:
+        print(f"  {filepath}: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_hash(args):
+    """ハッシュの無い保存済み画像の、内容のハッシュと知覚ハッシュをまとめて計算する"""
+    from image_save_core import ImageIndex, backfill_content_hashes, backfill_perceptual_hashes
+
+    if not os.path.isdir(args.save_dir):
+        print(f"フォルダが見つかりません: {args.save_dir}", file=sys.stderr)
+        return 1
+
+    def on_progress(done, total):
+        if not args.quiet:
+            print(f"\r{done}/{total} 枚を処理", end="", file=sys.stderr, flush=True)
+
+    index = ImageIndex(args.save_dir)
+    try:
+        for label, backfill in (
+            ("内容のハッシュ", lambda: backfill_content_hashes(index, args.workers, on_progress=on_progress)),
+            ("知覚ハッシュ", lambda: backfill_perceptual_hashes(index, args.processes, on_progress=on_progress)),
+        ):
+            started = time.perf_counter()
+            hashed, failed = backfill()
+            elapsed = time.perf_counter() - started
+            if not args.quiet and hashed + failed:
+                print(file=sys.stderr)
+            print(f"{hashed} 枚の{label}を計算しました（読めない画像 {failed} 枚、{elapsed:.2f} 秒）")
+    finally:
+        index.close()
+    return 0
+
+
+def cmd_similar(args):
+    """指定した画像に似ている保存済み画像を近い順に表示"""
+    from image_save_core import ImageIndex, SimilarImageIndex
+
+    index = ImageIndex(args.save_dir)
+    try:
+        results = SimilarImageIndex(index).find_similar(args.image, args.max_distance, args.limit)
+    finally:
+        index.close()
+
+    if args.json:
+        json.dump([{"distance": distance, "path": path} for distance, path in results], sys.stdout, indent=2)
+        print()
+        return 0
+    if not results:
+        print("似ている画像は見つかりませんでした（未計算の場合は先に hash を実行してください）")
+    for distance, path in results:
+        print(f"{distance:3d}  {path}")
+    return 0
+
+
+def build_parser():
+    """コマンドライン引数の定義"""
+    from image_save_core.ingest import INGEST_PROFILES
+    from image_save_core.layout import LAYOUTS
+    from image_save_core.save_pipeline import FSYNC_POLICIES
+    from image_save_core.storage import DEDUP_POLICIES
+
+    parser = argparse.ArgumentParser(prog="image-save-app", description="画像保存アプリのコマンドライン版")
+    parser.add_argument("--save-dir", default="saved_images", help="保存フォルダ（既定: saved_images）")
+    parser.add_argument("--metrics", default=None, metavar="FILE",
+                        help="処理時間を計測し、終了時に Prometheus 形式で書き出すファイル")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="フォルダ内の画像をまとめて取り込む")
+    ingest.add_argument("directory", help="取り込む画像のあるフォルダ")
+    ingest.add_argument("-r", "--recursive", action="store_true", help="サブフォルダも取り込む")
+    ingest.add_argument(
+        "--profile", default="original", choices=list(INGEST_PROFILES), help="保存前の縮小・形式変換（既定: original）",
+    )
+    ingest.add_argument("--dedup", default="skip", choices=DEDUP_POLICIES, help="重複画像の扱い（既定: skip）")
+    ingest.add_argument("--fsync", default="none", choices=FSYNC_POLICIES, help="ディスクへの書き込み保証（既定: none）")
+    ingest.add_argument("--workers", type=int, default=8, help="読み込み・書き込みのスレッド数（既定: 8）")
+    ingest.add_argument("--processes", type=int, default=None, help="変換のプロセス数（既定: CPU数）")
+    ingest.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    ingest.set_defaults(handler=cmd_ingest)
+
+    listing = commands.add_parser("list", help="保存済みの画像を新しい順に表示")
+    listing.add_argument("--since", help="この日以降（YYYY-MM-DD）")
+    listing.add_argument("--until", help="この日まで（YYYY-MM-DD）")
+    listing.add_argument("--limit", type=int, default=None, help="表示する最大件数")
+    listing.add_argument("--json", action="store_true", help="JSON で出力")
+    listing.set_defaults(handler=cmd_list)
+
+    exporting = commands.add_parser("export", help="保存済みの画像を ZIP ファイルに書き出す")
+    exporting.add_argument("destination", help="書き出す ZIP ファイルのパス")
+    exporting.add_argument("--since", help="この日以降（YYYY-MM-DD）")
+    exporting.add_argument("--until", help="この日まで（YYYY-MM-DD）")
+    exporting.set_defaults(handler=cmd_export)
+
+    pruning = commands.add_parser("prune", help="古い画像とゴミ箱・一時ファイルを整理")
+    pruning.add_argument("--older-than", type=float, default=None, metavar="DAYS",
+                         help="この日数より前に保存された画像をゴミ箱に移動")
+    pruning.add_argument("--trash-days", type=float, default=7, metavar="DAYS",
+                         help="ゴミ箱に残しておく日数（既定: 7）")
+    pruning.set_defaults(handler=cmd_prune)
+
+    migrating = commands.add_parser("migrate", help="保存フォルダの分け方を変更して画像を移動")
+    migrating.add_argument(
+        "--layout", required=True, choices=LAYOUTS,
+        help="flat: 分けない / date: 保存日ごと（年/月/日） / hash: ファイル名のハッシュで分散",
+    )
+    migrating.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    migrating.set_defaults(handler=cmd_migrate)
+
+    hashing = commands.add_parser("hash", help="重複の判定と似ている画像の検索用に、保存済み画像のハッシュを計算")
+    hashing.add_argument("--workers", type=int, default=8, help="内容のハッシュを計算するスレッド数（既定: 8）")
+    hashing.add_argument("--processes", type=int, default=None, help="知覚ハッシュを計算するプロセス数（既定: CPU数）")
+    hashing.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    hashing.set_defaults(handler=cmd_hash)
+
+    similar = commands.add_parser("similar", help="指定した画像に似ている保存済み画像を表示")
+    similar.add_argument("image", help="保存フォルダ内の画像のパス")
+    similar.add_argument("--max-distance", type=int, default=6, metavar="BITS",
+                         help="似ているとみなすハッシュの違い（64ビット中、既定: 6）")
+    similar.add_argument("--limit", type=int, default=None, help="表示する最大件数")
+    similar.add_argument("--json", action="store_true", help="JSON で出力")
+    similar.set_defaults(handler=cmd_similar)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics is None:
+        return args.handler(args)
+
+    from image_save_core import metrics
+
+    metrics.set_enabled(True)
+    try:
+        return args.handler(args)
+    finally:
+        metrics.write_prometheus(args.metrics)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())